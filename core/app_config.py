@@ -1,13 +1,75 @@
 """
-Конфигурация приложения с использованием Pydantic.
+Конфигурация приложения на неизменяемых dataclass секциях.
 """
-from pydantic import BaseSettings, Field, validator
-from pydantic.generics import GenericModel
-from typing import Optional, Dict, Any
+import dataclasses
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Mapping, Type, TypeVar
 from pathlib import Path
-from configparser import ConfigParser
+import functools
+import re
 
-class TelegramConfig(BaseSettings):
+# Встроенный комментарий: '#' или ';' после пробельного символа
+_INLINE_COMMENT_RE = re.compile(r'\s[#;].*$')
+
+_TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+
+_SectionT = TypeVar('_SectionT', bound='_ConfigSection')
+
+def _parse_ini_fast(path: Path) -> Dict[str, Dict[str, str]]:
+    """
+    Однопроходный разбор INI файла в словарь секций.
+    
+    Ключи приводятся к нижнему регистру (как в ConfigParser),
+    встроенные комментарии после пробела отбрасываются.
+    """
+    sections: Dict[str, Dict[str, str]] = {}
+    current: Optional[Dict[str, str]] = None
+    
+    for line in path.read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        
+        if line[0] == '[' and line[-1] == ']':
+            current = sections.setdefault(line[1:-1].strip(), {})
+            continue
+        
+        if current is None or '=' not in line:
+            continue
+        
+        key, value = line.split('=', 1)
+        current[key.strip().lower()] = _INLINE_COMMENT_RE.sub('', value).strip()
+    
+    return sections
+
+def _coerce(value: str, field_type: Any) -> Any:
+    """Приведение строкового значения INI к типу поля."""
+    if field_type is bool:
+        return value.strip().lower() in _TRUE_VALUES
+    if field_type is int:
+        return int(value)
+    if field_type == Optional[str]:
+        return value or None
+    return value
+
+class _ConfigSection:
+    """Базовый класс секции конфигурации."""
+    
+    @classmethod
+    def from_mapping(cls: Type[_SectionT], values: Mapping[str, str]) -> _SectionT:
+        """Создание секции из словаря строк с приведением типов."""
+        return cls(**{
+            field.name: _coerce(values[field.name], field.type)
+            for field in dataclasses.fields(cls)
+            if field.name in values
+        })
+    
+    def dict(self) -> Dict[str, Any]:
+        """Преобразование в словарь (поверхностное, поля - скаляры)."""
+        return {field.name: getattr(self, field.name) for field in dataclasses.fields(self)}
+
+@dataclass(frozen=True)
+class TelegramConfig(_ConfigSection):
     """Конфигурация Telegram."""
     api_id: int
     api_hash: str
@@ -15,7 +77,8 @@ class TelegramConfig(BaseSettings):
     session_name: str = "telegram_mail_bridge"
     test_mode: bool = True
     
-class SMTPConfig(BaseSettings):
+@dataclass(frozen=True)
+class SMTPConfig(_ConfigSection):
     """Конфигурация SMTP сервера."""
     host: str = "0.0.0.0"
     port: int = 1025
@@ -25,8 +88,19 @@ class SMTPConfig(BaseSettings):
     tls_enabled: bool = False
     tls_certfile: Optional[str] = None
     tls_keyfile: Optional[str] = None
+    auth_users: Optional[str] = None  # дополнительные "user:password" через запятую
+    
+    def users(self) -> Dict[str, str]:
+        """Все учётные записи SMTP: основная и из auth_users."""
+        users = {self.auth_username: self.auth_password}
+        for entry in (self.auth_users or '').split(','):
+            login, sep, password = entry.strip().partition(':')
+            if sep and login:
+                users[login] = password
+        return users
 
-class RedisConfig(BaseSettings):
+@dataclass(frozen=True)
+class RedisConfig(_ConfigSection):
     """Конфигурация Redis."""
     host: str = "localhost"
     port: int = 6379
@@ -35,71 +109,92 @@ class RedisConfig(BaseSettings):
     decode_responses: bool = False
     message_ttl: int = 604800  # 7 дней
 
-class DNSConfig(BaseSettings):
+@dataclass(frozen=True)
+class DNSConfig(_ConfigSection):
     """Конфигурация DNS."""
     target_domain: str = "t.me"
     timeout: int = 10
     lifetime: int = 30
+    nameservers: Optional[str] = None  # через запятую, например "1.1.1.1, 1.0.0.1"
 
-class CloudflareConfig(BaseSettings):
+@dataclass(frozen=True)
+class CloudflareConfig(_ConfigSection):
     """Конфигурация Cloudflare."""
     api_token: Optional[str] = None
     zone_id: Optional[str] = None
     domain: Optional[str] = None
 
-class LoggingConfig(BaseSettings):
+@dataclass(frozen=True)
+class LoggingConfig(_ConfigSection):
     """Конфигурация логгирования."""
     level: str = "INFO"
     file: str = "mail_bridge.log"
 
+@dataclass(frozen=True)
 class AppConfig:
-    """Основная конфигурация приложения."""
+    """
+    Основная конфигурация приложения.
+    
+    Неизменяема: from_ini_file возвращает один экземпляр на (путь, mtime)
+    всем вызывающим.
+    """
+    telegram: Optional[TelegramConfig] = None
+    smtp: Optional[SMTPConfig] = None
+    redis: Optional[RedisConfig] = None
+    dns: Optional[DNSConfig] = None
+    cloudflare: Optional[CloudflareConfig] = None
+    logging: Optional[LoggingConfig] = None
     
-    def __init__(self):
-        self.telegram = TelegramConfig()
-        self.smtp = SMTPConfig()
-        self.redis = RedisConfig()
-        self.dns = DNSConfig()
-        self.cloudflare = CloudflareConfig()
-        self.logging = LoggingConfig()
+    def __post_init__(self):
+        # Отсутствующие секции (кроме telegram) - значения по умолчанию
+        for field, default in (('smtp', SMTPConfig), ('redis', RedisConfig),
+                               ('dns', DNSConfig), ('cloudflare', CloudflareConfig),
+                               ('logging', LoggingConfig)):
+            if getattr(self, field) is None:
+                object.__setattr__(self, field, default())
     
     @classmethod
     def from_ini_file(cls, path: Path) -> "AppConfig":
-        """Загрузка конфигурации из INI файла."""
-        config = cls()
-        parser = ConfigParser()
-        parser.read(path)
+        """
+        Загрузка конфигурации из INI файла.
         
-        # Загрузка секций
-        if 'TELEGRAM' in parser:
-            config.telegram = TelegramConfig(
-                **dict(parser['TELEGRAM'])
-            )
-        
-        if 'SMTP' in parser:
-            config.smtp = SMTPConfig(
-                **dict(parser['SMTP'])
-            )
-        
-        if 'REDIS' in parser:
-            config.redis = RedisConfig(
-                **dict(parser['REDIS'])
-            )
+        Результат кэшируется по пути и времени изменения файла.
+        """
+        stat = Path(path).stat()
+        return _cached_config(str(path), stat.st_mtime_ns)
+    
+    @classmethod
+    def _load_ini_file(cls, path: Path) -> "AppConfig":
+        """Чтение и разбор INI файла без кэширования."""
+        sections = _parse_ini_fast(Path(path))
         
-        if 'CLOUDFLARE' in parser:
-            config.cloudflare = CloudflareConfig(
-                **dict(parser['CLOUDFLARE'])
-            )
+        def build(model: Type[_SectionT], section: str) -> Optional[_SectionT]:
+            if section not in sections:
+                return None
+            return model.from_mapping(sections[section])
         
-        return config
+        return cls(
+            telegram=build(TelegramConfig, 'TELEGRAM'),
+            smtp=build(SMTPConfig, 'SMTP'),
+            redis=build(RedisConfig, 'REDIS'),
+            dns=build(DNSConfig, 'DNS'),
+            cloudflare=build(CloudflareConfig, 'CLOUDFLARE')
+        )
     
     def dict(self) -> Dict[str, Any]:
         """Преобразование в словарь."""
         return {
-            'telegram': self.telegram.dict(),
+            'telegram': self.telegram.dict() if self.telegram else None,
             'smtp': self.smtp.dict(),
             'redis': self.redis.dict(),
             'dns': self.dns.dict(),
             'cloudflare': self.cloudflare.dict(),
             'logging': self.logging.dict()
-        }
\ No newline at end of file
+        }
+
+@functools.lru_cache(maxsize=8)
+def _cached_config(path_str: str, mtime_ns: int) -> AppConfig:
+    """Кэш загруженных конфигураций по (путь, mtime)."""
+    # mtime_ns - только часть ключа кэша: изменённый файл читается заново
+    del mtime_ns
+    return AppConfig._load_ini_file(Path(path_str))
\ No newline at end of file
@@ -1,27 +1,67 @@
 import httpx
 import asyncio
-from typing import Dict, Any, List, Optional
+import functools
+import time
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple
 from urllib.parse import urlparse
-import dns.resolver
+import msgspec
+from core.dns_validator import get_shared_resolver
+
+# Кодировщик JSON тел запросов к API
+_JSON_ENCODER = msgspec.json.Encoder()
+
+@functools.lru_cache(maxsize=None)
+def _auth_headers(api_token: str) -> "MappingProxyType[str, str]":
+    """Неизменяемые заголовки API, общие для менеджеров с одним токеном."""
+    return MappingProxyType({
+        "Authorization": f"Bearer {api_token}",
+        "Content-Type": "application/json"
+    })
 
 class CloudflareDNSManager:
     """Продвинутый менеджер DNS записей через Cloudflare API."""
     
-    def __init__(self, config: Dict[str, Any], logger):
+    # Общие параметры создаваемых записей
+    _DEFAULTS = MappingProxyType({"ttl": 300, "proxied": False})
+    
+    def __init__(self, config: Dict[str, Any], logger, resolver=None):
         self.config = config
         self.logger = logger
+        # Резолвер с настройками [DNS]; по умолчанию - системный
+        self.resolver = resolver or get_shared_resolver()
         self.api_token = config['api_token']
         self.zone_id = config['zone_id']
         self.domain = config['domain']
-        self.base_url = f"https://api.cloudflare.com/client/v4/zones/{self.zone_id}"
-        self.headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json"
-        }
-        self.client = httpx.AsyncClient(
-            headers=self.headers,
-            timeout=30.0
-        )
+        self.headers = _auth_headers(self.api_token)
+        
+        # Кэш списка записей зоны: (время загрузки, записи)
+        self._records_cache: Tuple[float, List[Dict[str, Any]]] = (0.0, [])
+        self._records_ttl = config.get('records_ttl', 60)
+        
+        # HTTP/2 клиент API (keep-alive пул), создаётся при первом запросе
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @functools.cached_property
+    def base_url(self) -> str:
+        """Базовый URL API зоны."""
+        return f"https://api.cloudflare.com/client/v4/zones/{self.zone_id}"
+    
+    @functools.cached_property
+    def _records_url(self) -> str:
+        """URL списка DNS записей зоны."""
+        return f"{self.base_url}/dns_records"
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """HTTP клиент менеджера (заголовки передаются в каждом запросе)."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20),
+                timeout=30.0
+            )
+        return self._client
     
     async def create_mx_record(self, 
                               subdomain: str,
@@ -32,22 +72,23 @@ class CloudflareDNSManager:
             record_name = f"{subdomain}.{self.domain}" if subdomain else self.domain
             
             data = {
+                **self._DEFAULTS,
                 "type": "MX",
                 "name": record_name,
                 "content": target,
-                "priority": priority,
-                "ttl": 300,
-                "proxied": False
+                "priority": priority
             }
             
             response = await self.client.post(
-                f"{self.base_url}/dns_records",
-                json=data
+                self._records_url,
+                content=_JSON_ENCODER.encode(data),
+                headers=self.headers
             )
             
             if response.status_code == 200:
                 result = response.json()
                 if result.get('success'):
+                    self._remember_record(result.get('result'))
                     self.logger.info(f"Создана MX запись для {record_name}")
                     return True
             
@@ -74,30 +115,45 @@ class CloudflareDNSManager:
                 {"priority": 20, "target": f"mx2.{self.domain}"}
             ]
             
-            mx_results = []
-            for mx in mx_servers:
-                success = await self.create_mx_record(
+            # Независимые записи создаются параллельно
+            results = await asyncio.gather(
+                *[
+                    self.create_mx_record(
+                        subdomain=subdomain,
+                        priority=mx['priority'],
+                        target=mx['target']
+                    )
+                    for mx in mx_servers
+                ],
+                # TXT запись для верификации
+                self.create_txt_record(
                     subdomain=subdomain,
-                    priority=mx['priority'],
-                    target=mx['target']
-                )
-                mx_results.append({
+                    content=f"telegram-mail-verify={telegram_username}"
+                ),
+                # CNAME для t.me (если требуется)
+                self.create_cname_record(
+                    name=f"{telegram_username}.tmail",
+                    target=f"{subdomain}.{self.domain}"
+                ),
+                return_exceptions=True
+            )
+            
+            # Исключение одной задачи не отменяет остальные
+            for result in results:
+                if isinstance(result, Exception):
+                    self.logger.error(f"Ошибка создания записи: {result}")
+            *mx_successes, txt_success, cname_success = [
+                result is True for result in results
+            ]
+            
+            mx_results = [
+                {
                     'server': mx['target'],
                     'priority': mx['priority'],
                     'success': success
-                })
-            
-            # Создание TXT записи для верификации
-            txt_success = await self.create_txt_record(
-                subdomain=subdomain,
-                content=f"telegram-mail-verify={telegram_username}"
-            )
-            
-            # Создание CNAME для t.me (если требуется)
-            cname_success = await self.create_cname_record(
-                name=f"{telegram_username}.tmail",
-                target=f"{subdomain}.{self.domain}"
-            )
+                }
+                for mx, success in zip(mx_servers, mx_successes)
+            ]
             
             return {
                 'telegram_username': telegram_username,
@@ -118,19 +174,25 @@ class CloudflareDNSManager:
             record_name = f"{subdomain}.{self.domain}" if subdomain else self.domain
             
             data = {
+                **self._DEFAULTS,
                 "type": "TXT",
                 "name": record_name,
-                "content": content,
-                "ttl": 300,
-                "proxied": False
+                "content": content
             }
             
             response = await self.client.post(
-                f"{self.base_url}/dns_records",
-                json=data
+                self._records_url,
+                content=_JSON_ENCODER.encode(data),
+                headers=self.headers
             )
             
-            return response.status_code == 200 and response.json().get('success')
+            if response.status_code == 200:
+                result = response.json()
+                if result.get('success'):
+                    self._remember_record(result.get('result'))
+                    return True
+            
+            return False
             
         except Exception as e:
             self.logger.error(f"Ошибка создания TXT: {e}")
@@ -140,41 +202,67 @@ class CloudflareDNSManager:
         """Создание CNAME записи."""
         try:
             data = {
+                **self._DEFAULTS,
                 "type": "CNAME",
                 "name": name,
-                "content": target,
-                "ttl": 300,
-                "proxied": False
+                "content": target
             }
             
             response = await self.client.post(
-                f"{self.base_url}/dns_records",
-                json=data
+                self._records_url,
+                content=_JSON_ENCODER.encode(data),
+                headers=self.headers
             )
             
-            return response.status_code == 200 and response.json().get('success')
+            if response.status_code == 200:
+                result = response.json()
+                if result.get('success'):
+                    self._remember_record(result.get('result'))
+                    return True
+            
+            return False
             
         except Exception as e:
             self.logger.error(f"Ошибка создания CNAME: {e}")
             return False
     
     async def get_dns_records(self, 
-                             record_type: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Получение всех DNS записей зоны."""
+                             record_type: Optional[str] = None,
+                             force_refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        Получение всех DNS записей зоны.
+        
+        Список зоны кэшируется на records_ttl секунд.
+        
+        Args:
+            record_type: Фильтр по типу записи
+            force_refresh: Игнорировать кэш
+        """
+        loaded_at, cached = self._records_cache
+        if not force_refresh and time.monotonic() - loaded_at < self._records_ttl:
+            if record_type:
+                return [r for r in cached if r.get('type') == record_type]
+            return list(cached)
+        
         try:
             params = {}
             if record_type:
                 params['type'] = record_type
             
             response = await self.client.get(
-                f"{self.base_url}/dns_records",
-                params=params
+                self._records_url,
+                params=params,
+                headers=self.headers
             )
             
             if response.status_code == 200:
                 result = response.json()
                 if result.get('success'):
-                    return result.get('result', [])
+                    records = result.get('result', [])
+                    # Кэшируется только полный список зоны
+                    if not record_type:
+                        self._records_cache = (time.monotonic(), list(records))
+                    return records
             
             return []
             
@@ -182,15 +270,21 @@ class CloudflareDNSManager:
             self.logger.error(f"Ошибка получения DNS записей: {e}")
             return []
     
+    def _remember_record(self, record: Optional[Dict[str, Any]]):
+        """Добавление созданной записи в кэш зоны без повторного GET."""
+        loaded_at, cached = self._records_cache
+        if record and loaded_at:
+            cached.append(record)
+    
     async def verify_dns_configuration(self, domain: str) -> Dict[str, Any]:
         """Проверка DNS конфигурации домена."""
         try:
-            resolver = dns.resolver.Resolver()
+            resolver = self.resolver
             
             # Проверка MX записей
             mx_records = []
             try:
-                answers = resolver.resolve(domain, 'MX')
+                answers = await resolver.resolve(domain, 'MX')
                 for rdata in answers:
                     mx_records.append({
                         'priority': rdata.preference,
@@ -202,7 +296,7 @@ class CloudflareDNSManager:
             # Проверка TXT записей
             txt_records = []
             try:
-                answers = resolver.resolve(domain, 'TXT')
+                answers = await resolver.resolve(domain, 'TXT')
                 for rdata in answers:
                     txt_records.append(str(rdata))
             except Exception as e:
@@ -212,7 +306,7 @@ class CloudflareDNSManager:
             mx_validation = []
             for mx in mx_records:
                 try:
-                    a_answers = resolver.resolve(mx['host'], 'A')
+                    a_answers = await resolver.resolve(mx['host'], 'A')
                     mx_validation.append({
                         'mx': mx['host'],
                         'ips': [str(a) for a in a_answers],
@@ -239,4 +333,6 @@ class CloudflareDNSManager:
     
     async def close(self):
         """Закрытие HTTP клиента."""
-        await self.client.aclose()
\ No newline at end of file
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
\ No newline at end of file
@@ -1,19 +1,66 @@
 """
 DNS валидатор для проверки MX записей и доменной инфраструктуры.
 """
+import asyncio
+import functools
+import ipaddress
+import time
+from collections import OrderedDict
+import dns.asyncresolver
 import dns.resolver
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
 
+@functools.lru_cache(maxsize=None)
+def get_shared_resolver(timeout: float = 10,
+                        lifetime: float = 30,
+                        nameservers: Optional[Tuple[str, ...]] = None) -> dns.asyncresolver.Resolver:
+    """
+    Общий асинхронный резолвер для заданных параметров.
+    
+    /etc/resolv.conf читается один раз на набор параметров,
+    все валидаторы с одинаковой конфигурацией используют один экземпляр.
+    """
+    resolver = dns.asyncresolver.Resolver(configure=True)
+    resolver.timeout = timeout
+    resolver.lifetime = lifetime
+    if nameservers:
+        resolver.nameservers = list(nameservers)
+    return resolver
+
+@functools.lru_cache(maxsize=4096)
+def _ip_to_ptr(ip: str) -> str:
+    """Имя для PTR запроса (in-addr.arpa / ip6.arpa) по IP адресу."""
+    return ipaddress.ip_address(ip).reverse_pointer
+
 class DNSSystemValidator:
     """Валидатор DNS инфраструктуры."""
     
     def __init__(self, config: Dict[str, Any], logger):
         self.config = config
         self.logger = logger
-        self.resolver = dns.resolver.Resolver()
-        self.resolver.timeout = config.get('timeout', 10)
-        self.resolver.lifetime = config.get('lifetime', 30)
+        self.resolver = get_shared_resolver(
+            config.get('timeout', 10),
+            config.get('lifetime', 30),
+            self._parse_nameservers(config.get('nameservers'))
+        )
+        # Ограничение параллельных запросов (лимиты публичных резолверов)
+        self._semaphore = asyncio.Semaphore(config.get('max_concurrency', 16))
+        
+        # Кэш ответов: (имя, тип) -> (истекает, записи, TTL или исключение)
+        self._cache: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._cache_size = config.get('cache_size', 1024)
+        self._max_ttl = config.get('max_ttl', 3600)
+        self._negative_ttl = config.get('negative_ttl', 60)
+    
+    @staticmethod
+    def _parse_nameservers(value) -> Optional[Tuple[str, ...]]:
+        """Список DNS серверов из конфигурации ("1.1.1.1, 1.0.0.1" или список)."""
+        if not value:
+            return None
+        if isinstance(value, str):
+            value = value.split(',')
+        return tuple(ns.strip() for ns in value if ns.strip()) or None
     
     async def validate_domain_mx(self, domain: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -42,24 +89,24 @@ class DNSSystemValidator:
         }
         
         try:
-            # Проверка MX записей
-            report['mx_records'] = await self._get_mx_records(target)
+            # Независимые запросы выполняются параллельно
+            report.update(await self.resolve_many(target, report['errors']))
             report['has_mx'] = len(report['mx_records']) > 0
             
-            # Дополнительные проверки
-            report['txt_records'] = await self._get_txt_records(target)
-            report['ns_records'] = await self._get_ns_records(target)
-            report['soa_record'] = await self._get_soa_record(target)
-            
             # Проверка A записей для MX хостов
-            for mx in report['mx_records']:
-                a_records = await self._get_a_records(mx['host'])
+            a_results = await asyncio.gather(*[
+                self._get_a_records(mx['host']) for mx in report['mx_records']
+            ])
+            for mx, a_records in zip(report['mx_records'], a_results):
                 report['a_records'].extend(a_records)
                 mx['resolved'] = len(a_records) > 0
             
             # Проверка обратных записей (PTR)
-            for a_record in report['a_records'][:3]:  # Ограничиваем количество
-                ptr_records = await self._get_ptr_records(a_record['ip'])
+            ptr_targets = report['a_records'][:3]  # Ограничиваем количество
+            ptr_results = await asyncio.gather(*[
+                self._get_ptr_records(a_record['ip']) for a_record in ptr_targets
+            ])
+            for a_record, ptr_records in zip(ptr_targets, ptr_results):
                 a_record['ptr'] = ptr_records
             
             self.logger.info(
@@ -74,15 +121,92 @@ class DNSSystemValidator:
         
         return report
     
+    async def resolve_many(self, domain: str, errors: List[str]) -> Dict[str, Any]:
+        """
+        Параллельное получение MX/TXT/NS/SOA записей домена.
+        
+        Ошибка одного запроса не прерывает остальные.
+        
+        Args:
+            domain: Домен для проверки
+            errors: Список, в который добавляются ошибки запросов
+            
+        Returns:
+            Успешно полученные записи по ключам отчета
+        """
+        lookups = {
+            'mx_records': self._get_mx_records(domain),
+            'txt_records': self._get_txt_records(domain),
+            'ns_records': self._get_ns_records(domain),
+            'soa_record': self._get_soa_record(domain)
+        }
+        results = await asyncio.gather(*lookups.values(), return_exceptions=True)
+        
+        records = {}
+        for key, result in zip(lookups, results):
+            if isinstance(result, Exception):
+                errors.append(f"Ошибка получения {key}: {result}")
+            else:
+                records[key] = result
+        return records
+    
+    async def _resolve(self, name: str, rdtype: str):
+        """Асинхронный DNS запрос с ограничением параллелизма."""
+        async with self._semaphore:
+            return await self.resolver.resolve(name, rdtype)
+    
+    async def _cached_resolve(self, name: str, rdtype: str) -> Tuple[list, Optional[int]]:
+        """
+        DNS запрос с кэшированием на время TTL.
+        
+        Отрицательные ответы (NXDOMAIN/NoAnswer) кэшируются на negative_ttl.
+        
+        Returns:
+            Список rdata и TTL набора записей
+        """
+        key = (name.lower(), rdtype)
+        now = time.monotonic()
+        
+        entry = self._cache.get(key)
+        if entry is not None:
+            expires_at, records, ttl, error = entry
+            if now < expires_at:
+                self._cache.move_to_end(key)
+                if error is not None:
+                    # Новое исключение: повторный raise сохранённого копил бы traceback
+                    error_type, message = error
+                    raise error_type(message)
+                return records, ttl
+            del self._cache[key]
+        
+        try:
+            answers = await self._resolve(name, rdtype)
+        except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN) as e:
+            # Кэшируется только тип и текст ошибки, без traceback и кадров
+            self._cache_put(key, (now + self._negative_ttl, [], None, (type(e), str(e))))
+            raise
+        
+        ttl = answers.rrset.ttl if answers.rrset is not None else None
+        records = list(answers)
+        self._cache_put(key, (now + min(ttl or 0, self._max_ttl), records, ttl, None))
+        return records, ttl
+    
+    def _cache_put(self, key: Tuple[str, str], entry: tuple):
+        """Запись в кэш с вытеснением самых старых элементов."""
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+    
     async def _get_mx_records(self, domain: str) -> List[Dict[str, Any]]:
         """Получение MX записей домена."""
         try:
-            answers = self.resolver.resolve(domain, 'MX')
+            answers, ttl = await self._cached_resolve(domain, 'MX')
             return [
                 {
                     'priority': rdata.preference,
                     'host': str(rdata.exchange).rstrip('.'),
-                    'ttl': answers.rrset.ttl if hasattr(answers, 'rrset') else None
+                    'ttl': ttl
                 }
                 for rdata in answers
             ]
@@ -96,7 +220,7 @@ class DNSSystemValidator:
     async def _get_txt_records(self, domain: str) -> List[str]:
         """Получение TXT записей домена."""
         try:
-            answers = self.resolver.resolve(domain, 'TXT')
+            answers, _ = await self._cached_resolve(domain, 'TXT')
             return [str(txt).strip('"') for txt in answers]
         except Exception:
             return []
@@ -104,7 +228,7 @@ class DNSSystemValidator:
     async def _get_a_records(self, hostname: str) -> List[Dict[str, Any]]:
         """Получение A записей хоста."""
         try:
-            answers = self.resolver.resolve(hostname, 'A')
+            answers, _ = await self._cached_resolve(hostname, 'A')
             return [{'host': hostname, 'ip': str(rdata)} for rdata in answers]
         except Exception:
             return []
@@ -112,7 +236,7 @@ class DNSSystemValidator:
     async def _get_ns_records(self, domain: str) -> List[str]:
         """Получение NS записей домена."""
         try:
-            answers = self.resolver.resolve(domain, 'NS')
+            answers, _ = await self._cached_resolve(domain, 'NS')
             return [str(ns).rstrip('.') for ns in answers]
         except Exception:
             return []
@@ -120,7 +244,7 @@ class DNSSystemValidator:
     async def _get_soa_record(self, domain: str) -> Optional[Dict[str, Any]]:
         """Получение SOA записи домена."""
         try:
-            answers = self.resolver.resolve(domain, 'SOA')
+            answers, _ = await self._cached_resolve(domain, 'SOA')
             if answers:
                 soa = answers[0]
                 return {
@@ -139,13 +263,8 @@ class DNSSystemValidator:
     async def _get_ptr_records(self, ip: str) -> List[str]:
         """Получение PTR записей (обратный DNS)."""
         try:
-            # Преобразование IP для PTR запроса
-            if ':' in ip:  # IPv6
-                ptr_query = '.'.join(reversed(ip.split(':'))) + '.ip6.arpa'
-            else:  # IPv4
-                ptr_query = '.'.join(reversed(ip.split('.'))) + '.in-addr.arpa'
-            
-            answers = self.resolver.resolve(ptr_query, 'PTR')
+            ptr_query = _ip_to_ptr(ip)
+            answers, _ = await self._cached_resolve(ptr_query, 'PTR')
             return [str(ptr).rstrip('.') for ptr in answers]
         except Exception:
             return []
\ No newline at end of file
@@ -1,11 +1,110 @@
-import pickle
-import json
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-import aioredis
+import asyncio
+import time
+from collections.abc import Mapping
+from typing import Optional, Dict, Any, List, Iterator, Tuple
+import redis.asyncio as aioredis
+import msgspec
 from email import message_from_bytes
 from email.policy import default
 
+# Кодировщики метаданных (заголовки email - подклассы str, приводим к str)
+_META_ENCODER = msgspec.json.Encoder(enc_hook=str)
+_META_DECODER = msgspec.json.Decoder()
+
+# Строка письма в /list и /search (без порядкового номера), готовится при записи
+_LIST_SUMMARY_TEMPLATE = (
+    "`{message_id}` - **{subject}**\n"
+    "   📨 {sender} → {recipient}\n"
+    "   🕐 {received_at}"
+)
+
+# Превью для /view: длина текста, размер декодируемого начала
+# (символ UTF-8 занимает до 4 байт) и число показываемых вложений
+_VIEW_BODY_CHARS = 1500
+_VIEW_BODY_BYTES = _VIEW_BODY_CHARS * 4
+_VIEW_ATTACHMENTS = 5
+
+# Атомарное сохранение письма, индексов и очистка устаревших записей
+# KEYS: raw, meta, индекс домена, индекс времени, краткая строка, превью
+# ARGV: raw письмо, метаданные, TTL, ID письма, timestamp, граница очистки,
+#       краткая строка, превью
+_STORE_EMAIL_LUA = """
+redis.call('SETEX', KEYS[1], ARGV[3], ARGV[1])
+redis.call('SETEX', KEYS[2], ARGV[3], ARGV[2])
+redis.call('SADD', KEYS[3], ARGV[4])
+redis.call('ZADD', KEYS[4], ARGV[5], ARGV[4])
+redis.call('ZREMRANGEBYSCORE', KEYS[4], 0, ARGV[6])
+redis.call('SETEX', KEYS[5], ARGV[3], ARGV[7])
+redis.call('SETEX', KEYS[6], ARGV[3], ARGV[8])
+return 1
+"""
+
+def render_list_summary(metadata: Dict[str, Any]) -> str:
+    """Краткая строка письма для списков."""
+    return _LIST_SUMMARY_TEMPLATE.format(
+        message_id=metadata.get('message_id', ''),
+        subject=str(metadata.get('subject', ''))[:50],
+        sender=str(metadata.get('from', ''))[:30],
+        recipient=str(metadata.get('to', ''))[:30],
+        received_at=metadata.get('received_at', '')
+    )
+
+def _is_attachment(part) -> bool:
+    """Часть письма - вложение (Content-Disposition: attachment)."""
+    return part.get_content_disposition() == "attachment"
+
+def _walk_parts(email_msg) -> Iterator[Any]:
+    """
+    Обход частей письма в порядке Message.walk() без захода во вложения.
+    
+    Пересланное письмо (message/rfc822) с disposition attachment - одно
+    вложение: его текст и вложения не смешиваются с частями письма.
+    """
+    stack = [email_msg]
+    while stack:
+        part = stack.pop()
+        yield part
+        if part.is_multipart() and (part is email_msg or not _is_attachment(part)):
+            stack.extend(reversed(part.get_payload()))
+
+class _HeadersView(Mapping):
+    """
+    Ленивое представление заголовков письма без копирования в dict.
+    
+    Имена не зависят от регистра и перечисляются по одному разу; для
+    повторяющихся заголовков (Received, DKIM-Signature) по ключу
+    возвращается первое значение, все значения - через get_all().
+    """
+    
+    __slots__ = ('_msg',)
+    
+    def __init__(self, email_msg):
+        self._msg = email_msg
+    
+    def __getitem__(self, name: str):
+        value = self._msg.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+    
+    def __contains__(self, name) -> bool:
+        return name in self._msg
+    
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        for name in self._msg.keys():
+            folded = name.lower()
+            if folded not in seen:
+                seen.add(folded)
+                yield name
+    
+    def __len__(self) -> int:
+        return len({name.lower() for name in self._msg.keys()})
+    
+    def get_all(self, name: str) -> List[Any]:
+        """Все значения заголовка в порядке следования."""
+        return self._msg.get_all(name, [])
+
 class RedisStorage:
     """Продвинутое хранилище для полных писем в Redis с сериализацией и TTL."""
     
@@ -14,18 +113,26 @@ class RedisStorage:
         self.logger = logger
         self.redis: Optional[aioredis.Redis] = None
         self.message_ttl = int(config.get('message_ttl', 604800))
+        self._store_script = None
+        
+        # Записи, ожидающие отправки одним pipeline: (keys, args, future)
+        self._pending_writes: List[Tuple[list, list, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
         
     async def connect(self):
         """Установка соединения с Redis."""
         try:
-            self.redis = await aioredis.from_url(
+            # from_url только создаёт пул, соединение проверяется ping
+            self.redis = aioredis.from_url(
                 f"redis://{self.config['host']}:{self.config['port']}",
                 password=self.config.get('password') or None,
                 db=int(self.config.get('db', 0)),
-                decode_responses=False,
-                encoding='utf-8'
+                decode_responses=False
             )
             await self.redis.ping()
+            
+            # Script выполняет EVALSHA и перезагружает скрипт при NOSCRIPT
+            self._store_script = self.redis.register_script(_STORE_EMAIL_LUA)
             self.logger.info("Успешное подключение к Redis")
         except Exception as e:
             self.logger.error(f"Ошибка подключения к Redis: {e}")
@@ -34,40 +141,45 @@ class RedisStorage:
     async def store_email(self, 
                          email_id: str, 
                          raw_email: bytes,
-                         metadata: Dict[str, Any]) -> bool:
-        """Сохранение полного письма и метаданных в Redis."""
+                         metadata: Dict[str, Any],
+                         view: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Сохранение полного письма и метаданных в Redis.
+        
+        Записи, поступившие за один проход event loop, отправляются
+        одним pipeline. Вместе с письмом сохраняется небольшое превью
+        для /view; view - превью от build_view, если уже построено.
+        """
         try:
-            pipeline = self.redis.pipeline()
-            
-            # Сериализация письма с помощью pickle
-            serialized_email = pickle.dumps(raw_email)
+            recipient = metadata.get('recipient_domain', 'unknown')
+            now = time.time()
+            if view is None:
+                view = self.build_view(message_from_bytes(raw_email, policy=default))
             
-            # Основное хранилище письма
-            pipeline.setex(
+            keys = [
                 f"email:raw:{email_id}",
-                self.message_ttl,
-                serialized_email
-            )
-            
-            # Метаданные в JSON
-            pipeline.setex(
                 f"email:meta:{email_id}",
+                f"index:domain:{recipient}",
+                "index:timestamp",
+                f"email:summary:{email_id}",
+                f"email:view:{email_id}"
+            ]
+            args = [
+                raw_email,
+                _META_ENCODER.encode(metadata),
                 self.message_ttl,
-                json.dumps(metadata, ensure_ascii=False)
-            )
-            
-            # Индексация по получателю
-            recipient = metadata.get('recipient_domain', 'unknown')
-            pipeline.sadd(f"index:domain:{recipient}", email_id)
-            
-            # Индексация по времени
-            timestamp = datetime.utcnow().isoformat()
-            pipeline.zadd("index:timestamp", {email_id: datetime.utcnow().timestamp()})
-            
-            await pipeline.execute()
+                email_id,
+                now,
+                now - self.message_ttl,
+                render_list_summary(metadata),
+                _META_ENCODER.encode(view)
+            ]
             
-            # Автоматическая очистка старых индексов
-            await self._cleanup_old_indexes()
+            future = asyncio.get_running_loop().create_future()
+            self._pending_writes.append((keys, args, future))
+            if self._flush_task is None:
+                self._flush_task = asyncio.ensure_future(self._flush_writes())
+            await future
             
             self.logger.debug(f"Письмо {email_id} сохранено в Redis")
             return True
@@ -76,117 +188,389 @@ class RedisStorage:
             self.logger.error(f"Ошибка сохранения письма {email_id}: {e}")
             return False
     
+    async def _flush_writes(self):
+        """Отправка накопленных записей одним pipeline."""
+        # Даём остальным обработчикам текущего тика добавить свои записи
+        await asyncio.sleep(0)
+        batch, self._pending_writes = self._pending_writes, []
+        self._flush_task = None
+        
+        try:
+            if len(batch) == 1:
+                keys, args, future = batch[0]
+                results = [await self._store_script(keys=keys, args=args)]
+            else:
+                pipeline = self.redis.pipeline(transaction=False)
+                for keys, args, _ in batch:
+                    await self._store_script(keys=keys, args=args, client=pipeline)
+                results = await pipeline.execute(raise_on_error=False)
+        except Exception as e:
+            results = [e] * len(batch)
+        
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+    
     async def retrieve_email(self, email_id: str) -> Optional[Dict[str, Any]]:
         """Полное извлечение письма и метаданных."""
         try:
-            pipeline = self.redis.pipeline()
-            pipeline.get(f"email:raw:{email_id}")
-            pipeline.get(f"email:meta:{email_id}")
-            results = await pipeline.execute()
-            
-            raw_email, meta_json = results
+            # MGET атомарен для обоих ключей - один RESP запрос вместо pipeline
+            raw_email, meta_json = await self.redis.mget(
+                f"email:raw:{email_id}",
+                f"email:meta:{email_id}"
+            )
             
             if not raw_email or not meta_json:
                 return None
             
-            # Десериализация письма
-            email_bytes = pickle.loads(raw_email)
-            metadata = json.loads(meta_json)
+            return self._build_email(raw_email, meta_json)
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка извлечения письма {email_id}: {e}")
+            return None
+    
+    async def retrieve_view(self, email_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Метаданные и превью письма для /view без чтения raw письма.
+        
+        Returns:
+            Словарь с metadata, body_preview, body_truncated, attachments
+            (первые вложения) и attachment_count
+        """
+        try:
+            meta_json, view_json = await self.redis.mget(
+                f"email:meta:{email_id}",
+                f"email:view:{email_id}"
+            )
+            
+            if not meta_json:
+                return None
             
-            # Парсинг письма
-            email_msg = message_from_bytes(email_bytes, policy=default)
+            if view_json:
+                view = _META_DECODER.decode(view_json)
+            else:
+                # Письмо сохранено без превью - строим по raw письму
+                raw_email = await self.redis.get(f"email:raw:{email_id}")
+                if not raw_email:
+                    return None
+                view = self.build_view(message_from_bytes(raw_email, policy=default))
             
-            return {
-                'raw': email_bytes,
-                'message': email_msg,
-                'metadata': metadata,
-                'parsed': self._parse_email_structure(email_msg)
-            }
+            view['metadata'] = _META_DECODER.decode(meta_json)
+            return view
             
         except Exception as e:
             self.logger.error(f"Ошибка извлечения письма {email_id}: {e}")
             return None
     
+    async def retrieve_emails_bulk(self, email_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Пакетное извлечение писем за один round-trip.
+        
+        Args:
+            email_ids: Идентификаторы писем
+            
+        Returns:
+            Найденные письма в порядке запроса (отсутствующие пропускаются)
+        """
+        if not email_ids:
+            return []
+        
+        try:
+            # Один MGET по всем ключам: сначала raw, затем meta
+            keys = [f"email:raw:{email_id}" for email_id in email_ids]
+            keys += [f"email:meta:{email_id}" for email_id in email_ids]
+            values = await self.redis.mget(keys)
+            raws, metas = values[:len(email_ids)], values[len(email_ids):]
+        except Exception as e:
+            self.logger.error(f"Ошибка извлечения писем {', '.join(email_ids)}: {e}")
+            return []
+        
+        emails = []
+        for email_id, raw_email, meta_json in zip(email_ids, raws, metas):
+            if not raw_email or not meta_json:
+                continue
+            
+            try:
+                emails.append(self._build_email(raw_email, meta_json))
+            except Exception as e:
+                self.logger.error(f"Ошибка извлечения письма {email_id}: {e}")
+        
+        return emails
+    
+    async def retrieve_metadata_bulk(self, email_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Пакетное извлечение только метаданных (без raw письма и MIME парсинга).
+        
+        Returns:
+            Записи вида {'metadata': ...} в порядке запроса
+        """
+        if not email_ids:
+            return []
+        
+        try:
+            metas = await self.redis.mget([f"email:meta:{email_id}" for email_id in email_ids])
+        except Exception as e:
+            self.logger.error(f"Ошибка извлечения метаданных {', '.join(email_ids)}: {e}")
+            return []
+        
+        emails = []
+        for email_id, meta_json in zip(email_ids, metas):
+            if not meta_json:
+                continue
+            
+            try:
+                emails.append({'metadata': _META_DECODER.decode(meta_json)})
+            except Exception as e:
+                self.logger.error(f"Ошибка извлечения метаданных {email_id}: {e}")
+        
+        return emails
+    
+    async def retrieve_summaries_bulk(self, email_ids: List[str]) -> List[str]:
+        """
+        Пакетное извлечение готовых строк для /list и /search.
+        
+        Для писем без сохранённой строки она строится по метаданным.
+        
+        Returns:
+            Строки в порядке запроса (отсутствующие письма пропускаются)
+        """
+        if not email_ids:
+            return []
+        
+        try:
+            summaries = await self.redis.mget(
+                [f"email:summary:{email_id}" for email_id in email_ids]
+            )
+            missing = [
+                email_id for email_id, summary in zip(email_ids, summaries)
+                if not summary
+            ]
+            rendered = {}
+            if missing:
+                for email_data in await self.retrieve_metadata_bulk(missing):
+                    metadata = email_data['metadata']
+                    rendered[metadata.get('message_id')] = render_list_summary(metadata)
+        except Exception as e:
+            self.logger.error(f"Ошибка извлечения списка {', '.join(email_ids)}: {e}")
+            return []
+        
+        result = []
+        for email_id, summary in zip(email_ids, summaries):
+            if summary:
+                result.append(summary.decode() if isinstance(summary, bytes) else summary)
+            elif email_id in rendered:
+                result.append(rendered[email_id])
+        
+        return result
+    
+    def build_view(self, email_msg) -> Dict[str, Any]:
+        """
+        Превью письма: начало текста и первые вложения.
+        
+        Декодируется только первая text/plain часть вне вложений (и только
+        её начало попадает в превью); HTML и вложения не декодируются.
+        Текст приводится к str в кодировке из MIME заголовков.
+        """
+        body, truncated, body_found = '', False, False
+        attachments: List[Dict[str, Any]] = []
+        attachment_count = 0
+        
+        for part in _walk_parts(email_msg):
+            if part is not email_msg and _is_attachment(part):
+                attachment_count += 1
+                if len(attachments) < _VIEW_ATTACHMENTS:
+                    attachments.append({
+                        'content_type': part.get_content_type(),
+                        'size': self._estimate_payload_size(part)
+                    })
+                continue
+            
+            if part.is_multipart():
+                continue
+            
+            if body_found or part.get_content_type() != "text/plain":
+                continue
+            
+            body_found = True
+            data = part.get_payload(decode=True) or b''
+            truncated = len(data) > _VIEW_BODY_BYTES
+            body = self._decode_text(data[:_VIEW_BODY_BYTES], part.get_content_charset())
+            truncated = truncated or len(body) > _VIEW_BODY_CHARS
+        
+        return {
+            'body_preview': body[:_VIEW_BODY_CHARS],
+            'body_truncated': truncated,
+            'attachments': attachments,
+            'attachment_count': attachment_count
+        }
+    
+    @staticmethod
+    def _decode_text(data: bytes, charset: Optional[str]) -> str:
+        """Декодирование текста в кодировке письма (UTF-8, если она неизвестна)."""
+        try:
+            return data.decode(charset or 'utf-8', errors='ignore')
+        except LookupError:
+            return data.decode('utf-8', errors='ignore')
+    
+    def _build_email(self, raw_email: bytes, meta_json: bytes) -> Dict[str, Any]:
+        """Десериализация и парсинг сохранённого письма."""
+        metadata = _META_DECODER.decode(meta_json)
+        email_msg = message_from_bytes(raw_email, policy=default)
+        
+        return {
+            'raw': raw_email,
+            'message': email_msg,
+            'metadata': metadata,
+            'parsed': self._parse_email_structure(email_msg)
+        }
+    
     async def search_emails(self, 
                            domain: Optional[str] = None,
                            limit: int = 50,
                            offset: int = 0) -> List[Dict[str, Any]]:
-        """Поиск писем по домену получателя."""
+        """
+        Поиск писем по домену получателя с полным содержимым.
+        
+        Для списков в Telegram используется search_summaries, которому
+        не нужны ни raw письмо, ни метаданные.
+        
+        Args:
+            domain: Домен получателя (по умолчанию - последние письма)
+            limit: Максимальное количество писем
+            offset: Смещение в индексе по времени
+        """
         try:
-            if domain:
-                email_ids = await self.redis.smembers(f"index:domain:{domain}")
-            else:
-                # Получаем последние письма по времени
-                email_ids = await self.redis.zrevrange(
-                    "index:timestamp", 
-                    offset, 
-                    offset + limit - 1
-                )
-            
-            emails = []
-            for email_id in list(email_ids)[:limit]:
-                email_data = await self.retrieve_email(email_id.decode() 
-                                                      if isinstance(email_id, bytes) 
-                                                      else email_id)
-                if email_data:
-                    emails.append(email_data)
-            
-            return emails
+            ids = await self._search_ids(domain, limit, offset)
+            return await self.retrieve_emails_bulk(ids)
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка поиска писем: {e}")
+            return []
+    
+    async def search_summaries(self, 
+                              domain: Optional[str] = None,
+                              limit: int = 50,
+                              offset: int = 0) -> List[str]:
+        """Поиск писем с возвратом только готовых строк для списков."""
+        try:
+            ids = await self._search_ids(domain, limit, offset)
+            return await self.retrieve_summaries_bulk(ids)
             
         except Exception as e:
             self.logger.error(f"Ошибка поиска писем: {e}")
             return []
     
-    async def _cleanup_old_indexes(self):
-        """Очистка устаревших индексов."""
+    async def count_emails(self) -> int:
+        """
+        Количество хранимых писем по индексу времени (без чтения писем).
+        
+        Устаревшие записи индекса удаляются только при сохранении нового
+        письма, поэтому считаются лишь записи моложе message_ttl.
+        """
         try:
-            cutoff = datetime.utcnow().timestamp() - self.message_ttl
-            await self.redis.zremrangebyscore("index:timestamp", 0, cutoff)
+            return await self.redis.zcount(
+                "index:timestamp", f"({time.time() - self.message_ttl}", "+inf"
+            )
         except Exception as e:
-            self.logger.warning(f"Ошибка очистки индексов: {e}")
+            self.logger.error(f"Ошибка подсчёта писем: {e}")
+            return 0
+    
+    async def _search_ids(self, domain: Optional[str], limit: int, offset: int) -> List[str]:
+        """ID писем по домену или последние по времени."""
+        if domain:
+            email_ids = await self.redis.smembers(f"index:domain:{domain}")
+        else:
+            # Получаем последние письма по времени
+            email_ids = await self.redis.zrevrange(
+                "index:timestamp", 
+                offset, 
+                offset + limit - 1
+            )
+        
+        return [
+            email_id.decode() if isinstance(email_id, bytes) else email_id
+            for email_id in list(email_ids)[:limit]
+        ]
     
     def _parse_email_structure(self, email_msg) -> Dict[str, Any]:
         """Детальный парсинг структуры письма."""
         structure = {
-            'headers': dict(email_msg.items()),
+            'headers': _HeadersView(email_msg),
             'parts': [],
             'attachments': [],
             'body': {
                 'plain': None,
-                'html': None
+                'html': None,
+                'charset': None
             }
         }
         
         if email_msg.is_multipart():
-            for part in email_msg.walk():
+            for part in _walk_parts(email_msg):
                 content_type = part.get_content_type()
                 content_disposition = str(part.get("Content-Disposition"))
                 
+                is_attachment = _is_attachment(part)
+                
+                # Декодируется только тело письма
+                if not is_attachment and content_type == "text/plain":
+                    structure['body']['plain'] = part.get_payload(decode=True) or b''
+                    structure['body']['charset'] = part.get_content_charset()
+                    continue
+                if not is_attachment and content_type == "text/html":
+                    structure['body']['html'] = part.get_payload(decode=True) or b''
+                    continue
+                
                 part_info = {
                     'content_type': content_type,
                     'content_disposition': content_disposition,
-                    'size': len(part.get_payload(decode=True) or b'')
+                    'size': self._estimate_payload_size(part)
                 }
                 
-                if "attachment" in content_disposition:
+                if is_attachment:
                     structure['attachments'].append(part_info)
-                elif content_type == "text/plain":
-                    structure['body']['plain'] = part.get_payload(decode=True)
-                elif content_type == "text/html":
-                    structure['body']['html'] = part.get_payload(decode=True)
                 else:
                     structure['parts'].append(part_info)
         else:
             content_type = email_msg.get_content_type()
             if content_type == "text/plain":
                 structure['body']['plain'] = email_msg.get_payload(decode=True)
+                structure['body']['charset'] = email_msg.get_content_charset()
             elif content_type == "text/html":
                 structure['body']['html'] = email_msg.get_payload(decode=True)
         
         return structure
     
+    def _estimate_payload_size(self, part) -> int:
+        """
+        Оценка размера декодированного содержимого без декодирования.
+        
+        Для base64 размер вычисляется по длине закодированных данных,
+        для остальных кодировок используется длина как есть.
+        """
+        if part.is_multipart():
+            # Вложенное письмо (message/rfc822) - размер его исходного текста
+            if part.get_content_type() == "message/rfc822":
+                return len(part.get_payload(0).as_bytes())
+            return 0
+        
+        raw = part.get_payload()
+        if not isinstance(raw, str):
+            return len(part.get_payload(decode=True) or b'')
+        
+        encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+        if encoding == 'base64':
+            encoded_len = len(raw) - raw.count('\n') - raw.count('\r')
+            padding = raw.rstrip()[-2:].count('=')
+            return max(encoded_len * 3 // 4 - padding, 0)
+        return len(raw)
+    
     async def disconnect(self):
         """Корректное отключение от Redis."""
         if self.redis:
-            await self.redis.close()
+            await self.redis.aclose()
             self.logger.info("Отключено от Redis")
\ No newline at end of file
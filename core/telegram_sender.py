@@ -0,0 +1,209 @@
+"""
+Общая очередь отправки сообщений Telegram с ограничением частоты.
+"""
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+# Максимальная длина текста сообщения Telegram
+_TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Разделитель ответов, объединённых в одно сообщение
+_COALESCE_SEPARATOR = "\n\n"
+
+class _OutgoingMessage:
+    """Сообщение, ожидающее отправки."""
+
+    __slots__ = ('chat_id', 'text', 'kwargs', 'future', 'coalesce')
+
+    def __init__(self,
+                 chat_id,
+                 text: str,
+                 kwargs: Dict[str, Any],
+                 future: asyncio.Future,
+                 coalesce: bool):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future
+        self.coalesce = coalesce
+
+class TelegramSender:
+    """
+    Отправка сообщений через одну очередь с token bucket.
+
+    Глобальный лимит - global_rate сообщений в секунду, для каждого чата -
+    не чаще одного сообщения в per_chat_interval секунд. Сообщения одного
+    чата отправляются в порядке поступления, готовые чаты не ждут остальных.
+    """
+
+    def __init__(self,
+                 client: Client,
+                 logger,
+                 global_rate: float = 30.0,
+                 per_chat_interval: float = 1.0):
+        self.client = client
+        self.logger = logger
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+
+        self._pending: Deque[_OutgoingMessage] = deque()
+        self._wakeup = asyncio.Event()
+        self._last_sent: Dict[Any, float] = {}
+        self._tokens = global_rate
+        self._tokens_updated: Optional[float] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запуск фонового воркера отправки."""
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        """Остановка воркера; неотправленные сообщения отменяются."""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+        while self._pending:
+            item = self._pending.popleft()
+            if not item.future.done():
+                item.future.cancel()
+
+    async def send(self, chat_id, text: str, coalesce: bool = False, **kwargs):
+        """
+        Постановка сообщения в очередь и ожидание его отправки.
+
+        Args:
+            coalesce: Разрешить объединение с соседними сообщениями чата,
+                      также отправленными с coalesce=True
+
+        Returns:
+            Отправленное сообщение (результат client.send_message)
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_OutgoingMessage(chat_id, text, kwargs, future, coalesce))
+        self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        """Цикл отправки с соблюдением лимитов."""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Вызывающий отменил ожидание (таймаут, остановка) - не отправляем
+            self._drop_cancelled()
+            if not self._pending:
+                continue
+
+            now = loop.time()
+            self._refill_tokens(now)
+
+            item, chat_wait = self._next_ready(now)
+            token_wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.global_rate
+            delay = max(chat_wait, token_wait)
+            if delay > 0:
+                # Новое сообщение для свободного чата прерывает ожидание
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            group = self._coalesce(item)
+            for queued in group:
+                self._pending.remove(queued)
+            self._tokens -= 1
+            self._last_sent[item.chat_id] = now
+
+            text = _COALESCE_SEPARATOR.join(queued.text for queued in group)
+            try:
+                result = await self.client.send_message(item.chat_id, text, **item.kwargs)
+            except asyncio.CancelledError:
+                # Воркер остановлен во время отправки - вызывающие не должны зависнуть
+                for queued in group:
+                    if not queued.future.done():
+                        queued.future.cancel()
+                raise
+            except FloodWait as e:
+                # Telegram просит подождать - пауза для всех чатов, сообщения повторяются
+                self.logger.warning(f"FloodWait {e.value} с, отправка приостановлена")
+                self._pending.extendleft(reversed(group))
+                await asyncio.sleep(e.value)
+                continue
+            except Exception as e:
+                for queued in group:
+                    if not queued.future.done():
+                        queued.future.set_exception(e)
+                continue
+
+            for queued in group:
+                if not queued.future.done():
+                    queued.future.set_result(result)
+
+    def _coalesce(self, item: _OutgoingMessage) -> List[_OutgoingMessage]:
+        """
+        Сообщения чата, отправляемые вместе с item одним сообщением.
+
+        Объединяются только сообщения, отправленные с coalesce=True: идущие
+        подряд сообщения чата без клавиатуры и с теми же параметрами, пока
+        текст помещается в лимит Telegram. Пока чат ждёт своего интервала,
+        его ответы накапливаются и уходят одним запросом.
+        """
+        group = [item]
+        if not item.coalesce or 'reply_markup' in item.kwargs:
+            return group
+
+        size = len(item.text)
+        for queued in self._pending:
+            if queued is item or queued.chat_id != item.chat_id:
+                continue
+            size += len(_COALESCE_SEPARATOR) + len(queued.text)
+            if (not queued.coalesce or queued.kwargs != item.kwargs or
+                    size > _TELEGRAM_MESSAGE_LIMIT):
+                break
+            group.append(queued)
+        return group
+
+    def _drop_cancelled(self):
+        """Удаление из очереди сообщений, ожидание которых уже отменено."""
+        if any(item.future.cancelled() for item in self._pending):
+            self._pending = deque(
+                item for item in self._pending if not item.future.cancelled()
+            )
+
+    def _refill_tokens(self, now: float):
+        """Пополнение глобального token bucket."""
+        if self._tokens_updated is not None:
+            elapsed = now - self._tokens_updated
+            self._tokens = min(self.global_rate, self._tokens + elapsed * self.global_rate)
+        self._tokens_updated = now
+
+    def _next_ready(self, now: float):
+        """Первое сообщение чата, который освободится раньше остальных."""
+        best, best_wait = None, float('inf')
+        seen = set()
+
+        for item in self._pending:
+            if item.chat_id in seen:
+                continue
+            seen.add(item.chat_id)
+
+            last_sent = self._last_sent.get(item.chat_id)
+            wait = 0.0 if last_sent is None else last_sent + self.per_chat_interval - now
+            if wait < best_wait:
+                best, best_wait = item, wait
+                if wait <= 0:
+                    break
+
+        return best, best_wait
@@ -5,9 +5,14 @@
 """
 
 import asyncio
+import hashlib
+import hmac
+import queue
 import sys
 from pathlib import Path
+from typing import Optional
 import signal
+import ssl
 
 # Добавление пути для импорта модулей
 sys.path.insert(0, str(Path(__file__).parent))
@@ -17,10 +22,17 @@ from core.telegram_client import EnhancedTelegramClient
 from core.dns_validator import DNSSystemValidator
 from core.cf_dns_manager import CloudflareDNSManager
 from core.redis_storage import RedisStorage
+from core.telegram_sender import TelegramSender
 from services.smtp_handler import AdvancedSMTPHandler
 from services.telegram_handler import TelegramCommandHandler
 from aiosmtpd.controller import Controller
 import logging
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    import uvloop
+except ImportError:  # uvloop недоступен (например, Windows)
+    uvloop = None
 
 class TelegramMailBridge:
     """Основной класс приложения."""
@@ -30,11 +42,13 @@ class TelegramMailBridge:
         self.config = AppConfig.from_ini_file(config_path)
         
         # Логгирование
+        self.log_listener = None
         self.logger = self._setup_logging()
         
         # Компоненты системы
         self.redis_storage = None
         self.tg_client = None
+        self.tg_sender = None
         self.dns_validator = None
         self.cf_manager = None
         self.smtp_handler = None
@@ -43,6 +57,7 @@ class TelegramMailBridge:
         
         # Флаги состояния
         self.is_running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
         
     def _setup_logging(self):
         """Настройка продвинутого логгирования."""
@@ -62,12 +77,21 @@ class TelegramMailBridge:
             encoding='utf-8'
         )
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
         
         # Консольный обработчик
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        
+        # Запись выполняется в отдельном потоке, event loop не блокируется
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(QueueHandler(log_queue))
+        self.log_listener = QueueListener(
+            log_queue,
+            file_handler,
+            console_handler,
+            respect_handler_level=True
+        )
+        self.log_listener.start()
         
         return logger
     
@@ -98,7 +122,8 @@ class TelegramMailBridge:
                 self.logger.info("Инициализация Cloudflare DNS менеджера...")
                 self.cf_manager = CloudflareDNSManager(
                     self.config.cloudflare.dict(),
-                    self.logger
+                    self.logger,
+                    resolver=self.dns_validator.resolver
                 )
             
             # 4. Telegram клиент
@@ -109,6 +134,10 @@ class TelegramMailBridge:
             )
             await self.tg_client.connect()
             
+            # Общая очередь отправки (лимиты Telegram на весь аккаунт)
+            self.tg_sender = TelegramSender(self.tg_client.client, self.logger)
+            self.tg_sender.start()
+            
             # 5. SMTP обработчик
             self.logger.info("Инициализация SMTP обработчика...")
             self.smtp_handler = AdvancedSMTPHandler(
@@ -116,32 +145,65 @@ class TelegramMailBridge:
                 redis_storage=self.redis_storage,
                 dns_validator=self.dns_validator,
                 cf_manager=self.cf_manager,
-                logger=self.logger
+                logger=self.logger,
+                sender=self.tg_sender,
+                loop=self._loop
             )
+            self.smtp_handler.start_notification_worker()
             
             # 6. Контроллер SMTP сервера
             self.logger.info("Запуск SMTP сервера...")
-            self.smtp_controller = Controller(
-                self.smtp_handler,
-                hostname=self.config.smtp.host,
-                port=self.config.smtp.port
-            )
+            smtp_cfg = self.config.smtp
+            smtp_options = {}
+            
+            # STARTTLS (если задан сертификат)
+            if smtp_cfg.tls_enabled and smtp_cfg.tls_certfile:
+                tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+                tls_context.load_cert_chain(smtp_cfg.tls_certfile, smtp_cfg.tls_keyfile or None)
+                smtp_options['tls_context'] = tls_context
             
             # Настройка аутентификации
-            if self.config.smtp.auth_required:
+            if smtp_cfg.auth_required:
                 from aiosmtpd.smtp import AuthResult
                 
-                async def authenticator(server, session, envelope, mechanism, auth_data):
-                    if (mechanism == 'PLAIN' and 
-                        auth_data.login == self.config.smtp.auth_username.encode() and
-                        auth_data.password == self.config.smtp.auth_password.encode()):
-                        return AuthResult(success=True)
-                    return AuthResult(success=False)
+                # Логин -> SHA-256 пароля, вычисляется один раз
+                credentials = {
+                    login.encode(): hashlib.sha256(password.encode()).digest()
+                    for login, password in smtp_cfg.users().items()
+                }
+                unknown_digest = bytes(hashlib.sha256().digest_size)
+                
+                # aiosmtpd вызывает authenticator синхронно; при отказе
+                # handled=False, чтобы сервер сам ответил клиенту 535
+                def authenticator(server, session, envelope, mechanism, auth_data):
+                    if mechanism != 'PLAIN':
+                        return AuthResult(success=False, handled=False)
+                    
+                    # Сравнение за постоянное время (защита от timing атак)
+                    expected = credentials.get(auth_data.login, unknown_digest)
+                    digest = hashlib.sha256(auth_data.password).digest()
+                    if (hmac.compare_digest(digest, expected) and
+                            auth_data.login in credentials):
+                        return AuthResult(success=True, auth_data=auth_data)
+                    return AuthResult(success=False, handled=False)
                 
-                self.smtp_controller.authenticator = authenticator
-                self.smtp_controller.auth_required = True
+                # Без STARTTLS AUTH PLAIN разрешается открытым текстом
+                smtp_options.update(
+                    authenticator=authenticator,
+                    auth_required=True,
+                    auth_require_tls='tls_context' in smtp_options
+                )
+            
+            # Параметры SMTP читаются только при создании контроллера
+            self.smtp_controller = Controller(
+                self.smtp_handler,
+                hostname=smtp_cfg.host,
+                port=smtp_cfg.port,
+                **smtp_options
+            )
             
             self.smtp_controller.start()
+            self.smtp_handler.controller = self.smtp_controller
             
             # 7. Обработчик команд Telegram
             self.logger.info("Инициализация обработчика команд...")
@@ -149,7 +211,8 @@ class TelegramMailBridge:
                 telegram_client=self.tg_client.client,
                 redis_storage=self.redis_storage,
                 smtp_handler=self.smtp_handler,
-                logger=self.logger
+                logger=self.logger,
+                sender=self.tg_sender
             )
             
             self.logger.info("Все компоненты инициализированы")
@@ -165,6 +228,12 @@ class TelegramMailBridge:
         try:
             self.logger.info("Запуск Telegram Mail Bridge System...")
             self.is_running = True
+            self._loop = asyncio.get_running_loop()
+            
+            # Eager task factory (Python 3.12+): задачи выполняются сразу до первого await
+            eager_task_factory = getattr(asyncio, 'eager_task_factory', None)
+            if eager_task_factory is not None:
+                self._loop.set_task_factory(eager_task_factory)
             
             # Инициализация
             if not await self.initialize_components():
@@ -193,14 +262,10 @@ class TelegramMailBridge:
             self.logger.info("Система готова к работе")
             
             # Ожидание сигналов завершения
-            loop = asyncio.get_event_loop()
             stop_event = asyncio.Event()
             
             for sig in (signal.SIGINT, signal.SIGTERM):
-                loop.add_signal_handler(
-                    sig, 
-                    lambda: stop_event.set()
-                )
+                self._loop.add_signal_handler(sig, stop_event.set)
             
             await stop_event.wait()
             self.logger.info("Получен сигнал завершения")
@@ -220,33 +285,56 @@ class TelegramMailBridge:
         self.logger.info("Завершение работы...")
         self.is_running = False
         
-        shutdown_tasks = []
-        
         # Остановка SMTP сервера
         if self.smtp_controller:
             self.logger.info("Остановка SMTP сервера...")
             self.smtp_controller.stop()
         
+        # Отправка оставшихся уведомлений
+        if self.smtp_handler:
+            await self.smtp_handler.stop_notification_worker()
+        
+        # Остановка очереди отправки Telegram
+        if self.tg_sender:
+            await self.tg_sender.close()
+        
+        # Независимые соединения закрываются параллельно
+        shutdown_tasks = []
+        
         # Отключение Telegram
         if self.tg_client:
             self.logger.info("Отключение от Telegram...")
-            await self.tg_client.disconnect()
+            shutdown_tasks.append(self.tg_client.disconnect())
         
         # Закрытие Cloudflare клиента
         if self.cf_manager:
             self.logger.info("Закрытие Cloudflare соединения...")
-            await self.cf_manager.close()
+            shutdown_tasks.append(self.cf_manager.close())
         
         # Отключение Redis
         if self.redis_storage:
             self.logger.info("Отключение от Redis...")
-            await self.redis_storage.disconnect()
+            shutdown_tasks.append(self.redis_storage.disconnect())
         
         # Ожидание завершения всех задач
-        if shutdown_tasks:
-            await asyncio.gather(*shutdown_tasks, return_exceptions=True)
+        results = await asyncio.gather(*shutdown_tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                self.logger.warning(f"Ошибка при завершении: {result}")
+        
+        # Отмена оставшихся фоновых задач
+        current_task = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current_task]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
         
         self.logger.info("Все компоненты остановлены. Выход.")
+        
+        # Запись оставшихся сообщений лога
+        if self.log_listener:
+            self.log_listener.stop()
+            self.log_listener = None
 
 def main():
     """Точка входа в приложение."""
@@ -266,14 +354,10 @@ def main():
         # Создание и запуск приложения
         app = TelegramMailBridge(config_path)
         
-        # Запуск асинхронного event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            loop.run_until_complete(app.run())
-        finally:
-            loop.close()
+        # Запуск асинхронного event loop (uvloop при наличии)
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        asyncio.run(app.run())
             
     except Exception as e:
         print(f"\n❌ Фатальная ошибка: {e}")
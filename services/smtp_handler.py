@@ -1,11 +1,58 @@
 import asyncio
-from email import message_from_bytes
+import functools
+from email.parser import BytesParser
 from email.policy import default
+from email.utils import parseaddr
 from aiosmtpd.controller import Controller
 from aiosmtpd.handlers import Message as SmtpMessageHandler
 from aiosmtpd.smtp import AuthResult, LoginPassword, SMTP as SMTPServer
-import uuid
+import time
+from collections import OrderedDict
 from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple
+
+# Парсер писем (policy=default - современный EmailMessage API)
+_EMAIL_PARSER = BytesParser(policy=default)
+
+@functools.lru_cache(maxsize=256)
+def _domain_of(email_address: str) -> str:
+    """Домен из адреса, в том числе в форме "Имя <user@domain>"."""
+    _, address = parseaddr(email_address)
+    at = address.rfind('@')
+    if at >= 0:
+        return address[at + 1:].strip().lower()
+    return 'unknown'
+
+# Разделитель уведомлений, объединённых в одно сообщение
+_NOTIFICATION_SEPARATOR = "\n\n---\n\n"
+
+# Максимальная длина текста сообщения Telegram
+_TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Превью писем крупнее этого размера декодируется в пуле потоков
+_FORMAT_IN_THREAD_SIZE = 256 * 1024
+
+# Заголовки, сохраняемые в метаданных помимо основных полей
+_STORED_HEADERS = ('Message-ID', 'Reply-To', 'Return-Path', 'Received')
+
+# Шаблоны уведомления: заголовок и опциональные блоки (начинаются с перевода строки)
+_NOTIFICATION_HEADER = (
+    "📧 **Новое письмо #{number}**\n"
+    "`{msg_id}`\n"
+    "\n"
+    "**От:** `{sender}`\n"
+    "**Кому:** `{to}`\n"
+    "**Тема:** {subject}\n"
+    "**Дата:** {date}\n"
+)
+_NOTIFICATION_DNS = "\n**DNS:** {status} {count} MX записей"
+_NOTIFICATION_PREVIEW = "\n\n**Превью:**\n```\n{preview}...\n```"
+_NOTIFICATION_COMMANDS = (
+    "\n\n**Команды:**\n"
+    "• `/view {msg_id}` - Просмотр полного письма\n"
+    "• `/source {msg_id}` - Исходный код письма\n"
+    "• `/set_target {msg_id} [me/channel/group/id]` - Изменить получателя"
+)
 
 class AdvancedSMTPHandler(SmtpMessageHandler):
     """Продвинутый обработчик SMTP с интеграцией Redis и Telegram."""
@@ -16,15 +63,32 @@ class AdvancedSMTPHandler(SmtpMessageHandler):
                  dns_validator,
                  cf_manager,
                  logger,
-                 target_mapping: Dict[str, str] = None):
+                 target_mapping: Dict[str, str] = None,
+                 notification_queue_size: int = 1000,
+                 dns_cache_ttl: float = 300,
+                 dns_cache_size: int = 1024,
+                 notification_batch_size: int = 10,
+                 notification_batch_window: float = 0.25,
+                 sender=None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
         super().__init__()
         self.tg_client = telegram_client
+        # Общая очередь отправки Telegram (TelegramSender), если задана
+        self.sender = sender
         self.redis_storage = redis_storage
         self.dns_validator = dns_validator
         self.cf_manager = cf_manager
         self.logger = logger
         self.target_mapping = target_mapping or {}
         self.message_counter = 0
+        # Контроллер SMTP сервера (назначается при запуске)
+        self.controller: Optional[Controller] = None
+        # Основной цикл событий: Controller aiosmtpd работает в своём потоке
+        # со своим циклом, а Redis, очередь уведомлений и Telegram привязаны
+        # к основному
+        self._main_loop = loop or asyncio.get_running_loop()
+        # Время запуска процесса - префикс уникальных ID писем
+        self._epoch = time.time_ns()
         
         # Настройка получателей по умолчанию
         self.default_recipients = {
@@ -32,32 +96,140 @@ class AdvancedSMTPHandler(SmtpMessageHandler):
             'channel': None,  # ID канала (настраивается через команду)
             'group': None     # ID группы (настраивается через команду)
         }
+        # Текущий получатель в виде "тип: ID" (обновляется вместе с default_recipients)
+        self.active_target = 'me: self'
+        
+        # Очередь уведомлений: SMTP ответ не ждёт отправки в Telegram
+        self._tg_queue: asyncio.Queue = asyncio.Queue(maxsize=notification_queue_size)
+        # Места в очереди, занятые письмами, которые ещё сохраняются
+        self._tg_reserved = 0
+        self._notify_task: Optional[asyncio.Task] = None
+        self._batch_size = notification_batch_size
+        self._batch_window = notification_batch_window
+        
+        # Фоновые задачи (ссылки удерживаются до завершения)
+        self._background_tasks: set = set()
+        
+        # Кэш отчётов DNS валидации: домен -> (истекает, отчёт)
+        self._dns_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._dns_cache_ttl = dns_cache_ttl
+        self._dns_cache_size = dns_cache_size
+    
+    def start_notification_worker(self):
+        """Запуск фоновой отправки уведомлений."""
+        if self._notify_task is None:
+            self._notify_task = asyncio.ensure_future(self._notify_worker())
+    
+    async def stop_notification_worker(self, timeout: float = 10.0):
+        """Отправка оставшихся уведомлений и остановка воркера."""
+        if self._notify_task is None:
+            return
+        
+        try:
+            await asyncio.wait_for(self._tg_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"Не отправлено уведомлений: {self._tg_queue.qsize()}"
+            )
+        
+        self._notify_task.cancel()
+        await asyncio.gather(self._notify_task, return_exceptions=True)
+        self._notify_task = None
     
-    async def handle_message(self, message):
+    async def _notify_worker(self):
+        """
+        Отправка уведомлений из очереди пачками.
+        
+        Уведомления, накопленные за notification_batch_window секунд
+        (не более notification_batch_size), объединяются по получателям.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._tg_queue.get()]
+            deadline = loop.time() + self._batch_window
+            
+            while len(batch) < self._batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._tg_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                await self._send_notification_batch(batch)
+            finally:
+                for _ in batch:
+                    self._tg_queue.task_done()
+    
+    async def handle_DATA(self, server, session, envelope):
+        """
+        Приём DATA напрямую из envelope.
+        
+        Базовый Message.handle_DATA строит email.message.Message,
+        который затем пришлось бы сериализовать обратно в байты.
+        Вызывается в потоке Controller, поэтому обработка письма
+        переносится в основной цикл событий.
+        """
+        raw_email = envelope.original_content or envelope.content
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self.handle_message(raw_email), self._main_loop)
+        )
+    
+    async def handle_message(self, raw_email: bytes):
         """Обработка входящего SMTP сообщения."""
+        # Очередь уведомлений переполнена - просим отправителя повторить позже.
+        # Место резервируется до сохранения письма: иначе параллельные сессии
+        # проходят проверку, а после записи в Redis получают QueueFull
+        maxsize = self._tg_queue.maxsize
+        if maxsize and self._tg_queue.qsize() + self._tg_reserved >= maxsize:
+            self.logger.warning("Очередь уведомлений переполнена")
+            return "451 Notification queue is full, try again later"
+        self._tg_reserved += 1
+        reserved = True
+        
         self.message_counter += 1
-        msg_id = f"msg_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        msg_id = f"msg_{self._epoch}_{self.message_counter}"
         
         try:
-            # Парсинг письма
-            raw_email = bytes(message)
-            email_msg = message_from_bytes(raw_email, policy=default)
+            # Парсинг письма (единственный проход по исходным байтам)
+            email_msg = _EMAIL_PARSER.parsebytes(raw_email)
             
             # Извлечение метаданных
             metadata = self._extract_metadata(email_msg, msg_id)
+            metadata['size'] = len(raw_email)
             
             # Проверка DNS домена получателя
             dns_report = await self._validate_recipient_dns(metadata['recipient_domain'])
             metadata['dns_report'] = dns_report
             
+            # Превью для /view и уведомления (крупные письма - в пуле потоков)
+            if metadata['size'] > _FORMAT_IN_THREAD_SIZE:
+                view = await asyncio.get_running_loop().run_in_executor(
+                    None, self.redis_storage.build_view, email_msg
+                )
+            else:
+                view = self.redis_storage.build_view(email_msg)
+            preview = view['body_preview']
+            
             # Сохранение полного письма в Redis
-            await self.redis_storage.store_email(msg_id, raw_email, metadata)
+            # (при ошибке записи место в очереди освобождается в finally)
+            if not await self.redis_storage.store_email(msg_id, raw_email, metadata, view):
+                self.logger.error(f"[{msg_id}] Не удалось сохранить письмо в Redis")
+                return "451 Requested action aborted: local error in processing"
             
-            # Формирование и отправка уведомления в Telegram
-            await self._send_telegram_notification(msg_id, email_msg, metadata)
+            # Уведомление в Telegram отправляется фоновым воркером
+            # (в очереди только превью, а не разобранное письмо)
+            self._tg_reserved -= 1
+            reserved = False
+            self._tg_queue.put_nowait((msg_id, preview, metadata))
             
-            # Интеграция с Cloudflare DNS при необходимости
-            await self._handle_dns_integration(metadata)
+            # Интеграция с Cloudflare DNS в фоне (только для *.t.me)
+            if self.cf_manager and metadata['recipient_domain'].endswith('.t.me'):
+                task = asyncio.ensure_future(self._handle_dns_integration(metadata))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
             
             self.logger.info(f"[{msg_id}] Письмо обработано: {metadata['subject']}")
             return f"250 Message {msg_id} accepted"
@@ -65,11 +237,16 @@ class AdvancedSMTPHandler(SmtpMessageHandler):
         except Exception as e:
             self.logger.error(f"[{msg_id}] Ошибка обработки: {e}", exc_info=True)
             return f"451 Temporary processing error: {str(e)}"
+        
+        finally:
+            if reserved:
+                self._tg_reserved -= 1
     
     def _extract_metadata(self, email_msg, msg_id: str) -> Dict[str, Any]:
         """Извлечение метаданных из письма."""
         return {
             'message_id': msg_id,
+            'message_number': self.message_counter,
             'from': email_msg.get('From', ''),
             'to': email_msg.get('To', ''),
             'cc': email_msg.get('Cc', ''),
@@ -78,54 +255,103 @@ class AdvancedSMTPHandler(SmtpMessageHandler):
             'date': email_msg.get('Date', ''),
             'recipient_domain': self._extract_domain(email_msg.get('To', '')),
             'received_at': datetime.utcnow().isoformat(),
-            'headers': dict(email_msg.items())
+            'headers': {
+                name: email_msg[name] for name in _STORED_HEADERS if name in email_msg
+            }
         }
     
     def _extract_domain(self, email_address: str) -> str:
         """Извлечение домена из email адреса."""
-        if '@' in email_address:
-            return email_address.split('@')[1].strip().lower()
-        return 'unknown'
+        return _domain_of(str(email_address))
     
     async def _validate_recipient_dns(self, domain: str) -> Dict[str, Any]:
-        """Валидация DNS домена получателя."""
+        """Валидация DNS домена получателя (с кэшированием на dns_cache_ttl)."""
         if self.dns_validator:
+            now = asyncio.get_running_loop().time()
+            cached = self._dns_cache.get(domain)
+            if cached is not None and cached[0] > now:
+                self._dns_cache.move_to_end(domain)
+                return cached[1]
+            
             try:
-                return await self.dns_validator.validate_domain_mx(domain)
+                report = await self.dns_validator.validate_domain_mx(domain)
+                self._dns_cache[domain] = (now + self._dns_cache_ttl, report)
+                self._dns_cache.move_to_end(domain)
+                while len(self._dns_cache) > self._dns_cache_size:
+                    self._dns_cache.popitem(last=False)
+                return report
             except Exception as e:
                 self.logger.warning(f"Ошибка DNS валидации: {e}")
         
         return {'domain': domain, 'error': 'Validator not available'}
     
-    async def _send_telegram_notification(self, 
-                                         msg_id: str,
-                                         email_msg,
-                                         metadata: Dict[str, Any]):
-        """Отправка уведомления в выбранный чат/канал."""
-        try:
-            # Определение получателя
-            recipient_type, recipient_id = self._determine_recipient(metadata)
-            
-            if not recipient_id:
-                self.logger.warning(f"[{msg_id}] Не указан получатель")
-                return
-            
-            # Форматирование сообщения
-            formatted_msg = self._format_notification(msg_id, email_msg, metadata)
-            
-            # Отправка в Telegram
-            if recipient_type == 'me':
-                await self.tg_client.send_message("me", formatted_msg)
-            else:
-                await self.tg_client.send_message(
-                    int(recipient_id),
-                    formatted_msg
-                )
-            
-            self.logger.debug(f"[{msg_id}] Уведомление отправлено в {recipient_type}:{recipient_id}")
-            
-        except Exception as e:
-            self.logger.error(f"[{msg_id}] Ошибка отправки в Telegram: {e}")
+    async def _send_notification_batch(self, batch: List[Tuple[str, str, Dict[str, Any]]]):
+        """Отправка пачки уведомлений: одно сообщение на получателя."""
+        buckets: Dict[Tuple[str, Any], List[Tuple[str, str]]] = {}
+        
+        for msg_id, preview, metadata in batch:
+            try:
+                # Определение получателя
+                recipient = self._determine_recipient(metadata)
+                
+                if not recipient[1]:
+                    self.logger.warning(f"[{msg_id}] Не указан получатель")
+                    continue
+                
+                # Форматирование сообщения
+                formatted_msg = self._format_notification(msg_id, preview, metadata)
+                buckets.setdefault(recipient, []).append((msg_id, formatted_msg))
+                
+            except Exception as e:
+                self.logger.error(f"[{msg_id}] Ошибка формирования уведомления: {e}")
+        
+        for (recipient_type, recipient_id), notifications in buckets.items():
+            for msg_ids, text in self._join_notifications(notifications):
+                try:
+                    await self._send_to_recipient(recipient_type, recipient_id, text)
+                    self.logger.debug(
+                        f"[{', '.join(msg_ids)}] Уведомление отправлено в "
+                        f"{recipient_type}:{recipient_id}"
+                    )
+                except Exception as e:
+                    self.logger.error(f"[{', '.join(msg_ids)}] Ошибка отправки в Telegram: {e}")
+    
+    def _join_notifications(self, notifications: List[Tuple[str, str]]):
+        """Объединение уведомлений в сообщения в пределах лимита Telegram."""
+        msg_ids: List[str] = []
+        texts: List[str] = []
+        size = 0
+        
+        for msg_id, text in notifications:
+            added = len(text) + (len(_NOTIFICATION_SEPARATOR) if texts else 0)
+            if texts and size + added > _TELEGRAM_MESSAGE_LIMIT:
+                yield msg_ids, _NOTIFICATION_SEPARATOR.join(texts)
+                msg_ids, texts, size = [], [], 0
+                added = len(text)
+            msg_ids.append(msg_id)
+            texts.append(text)
+            size += added
+        
+        if texts:
+            yield msg_ids, _NOTIFICATION_SEPARATOR.join(texts)
+    
+    async def _send_to_recipient(self, recipient_type: str, recipient_id, text: str):
+        """Отправка текста в Telegram выбранному получателю."""
+        send = self.sender.send if self.sender else self.tg_client.send_message
+        if recipient_type == 'me':
+            await send("me", text)
+        else:
+            await send(int(recipient_id), text)
+    
+    def set_default_recipient(self, target_type: str, target_id='self'):
+        """Выбор получателя по умолчанию: 'me', 'channel' или 'group'."""
+        self.default_recipients.update({
+            'me': None,
+            'channel': None,
+            'group': None,
+            target_type: target_id
+        })
+        self.active_target = f"{target_type}: {target_id}"
     
     def _determine_recipient(self, metadata: Dict[str, Any]) -> tuple:
         """Определение получателя на основе настроек и команд."""
@@ -144,76 +370,55 @@ class AdvancedSMTPHandler(SmtpMessageHandler):
     
     def _format_notification(self, 
                             msg_id: str,
-                            email_msg,
+                            body_preview: str,
                             metadata: Dict[str, Any]) -> str:
         """Форматирование уведомления для Telegram."""
-        lines = [
-            f"📧 **Новое письмо #{self.message_counter}**",
-            f"`{msg_id}`",
-            f"",
-            f"**От:** `{metadata['from']}`",
-            f"**Кому:** `{metadata['to']}`",
-            f"**Тема:** {metadata['subject']}",
-            f"**Дата:** {metadata['date']}",
-            f""
-        ]
+        parts = [_NOTIFICATION_HEADER.format(
+            number=metadata['message_number'],
+            msg_id=msg_id,
+            sender=metadata['from'],
+            to=metadata['to'],
+            subject=metadata['subject'],
+            date=metadata['date']
+        )]
         
         # DNS информация
         dns_report = metadata.get('dns_report', {})
         if dns_report.get('mx_records'):
-            mx_status = "✅" if dns_report.get('has_mx') else "⚠️"
-            lines.append(f"**DNS:** {mx_status} {len(dns_report['mx_records'])} MX записей")
+            parts.append(_NOTIFICATION_DNS.format(
+                status="✅" if dns_report.get('has_mx') else "⚠️",
+                count=len(dns_report['mx_records'])
+            ))
         
         # Тело письма (первые 200 символов)
-        body_preview = self._extract_body_preview(email_msg)
         if body_preview:
-            lines.append(f"")
-            lines.append(f"**Превью:**")
-            lines.append(f"```")
-            lines.append(f"{body_preview[:200]}...")
-            lines.append(f"```")
+            parts.append(_NOTIFICATION_PREVIEW.format(preview=body_preview[:200]))
         
         # Команды для управления
-        lines.append(f"")
-        lines.append(f"**Команды:**")
-        lines.append(f"• `/view {msg_id}` - Просмотр полного письма")
-        lines.append(f"• `/source {msg_id}` - Исходный код письма")
-        lines.append(f"• `/set_target {msg_id} [me/channel/group/id]` - Изменить получателя")
-        
-        return "\n".join(lines)
-    
-    def _extract_body_preview(self, email_msg) -> str:
-        """Извлечение текста письма для превью."""
-        if email_msg.is_multipart():
-            for part in email_msg.walk():
-                if part.get_content_type() == "text/plain":
-                    try:
-                        return part.get_content()[:500]
-                    except:
-                        pass
-        else:
-            if email_msg.get_content_type() == "text/plain":
-                return email_msg.get_content()[:500]
-        return ""
+        parts.append(_NOTIFICATION_COMMANDS.format(msg_id=msg_id))
+        
+        return "".join(parts)
     
     async def _handle_dns_integration(self, metadata: Dict[str, Any]):
         """Обработка интеграции с Cloudflare DNS."""
         try:
             domain = metadata['recipient_domain']
             
-            # Если домен связан с t.me
-            if domain.endswith('.t.me') or 't.me' in domain:
-                telegram_username = domain.replace('.t.me', '').replace('@', '')
-                
-                # Настройка DNS через Cloudflare
-                result = await self.cf_manager.ensure_tmail_integration(
-                    telegram_username
-                )
-                
-                if 'error' not in result:
-                    self.logger.info(f"DNS интеграция настроена для {telegram_username}")
-                else:
-                    self.logger.warning(f"Ошибка DNS интеграции: {result['error']}")
-                    
+            # Только поддомены t.me
+            if not domain.endswith('.t.me'):
+                return
+            
+            telegram_username = domain[:-len('.t.me')].replace('@', '')
+            
+            # Настройка DNS через Cloudflare
+            result = await self.cf_manager.ensure_tmail_integration(
+                telegram_username
+            )
+            
+            if 'error' not in result:
+                self.logger.info(f"DNS интеграция настроена для {telegram_username}")
+            else:
+                self.logger.warning(f"Ошибка DNS интеграции: {result['error']}")
+            
         except Exception as e:
             self.logger.error(f"Ошибка DNS интеграции: {e}")
\ No newline at end of file
@@ -1,9 +1,97 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.enums import ParseMode
+from pyrogram.enums import ChatType, ParseMode
 import json
+import re
 import base64
+import time
 from typing import Optional, Dict, Any
+from core.telegram_sender import TelegramSender
+
+# Тексты и клавиатуры команд создаются один раз при импорте
+_HELP_TEXT = """\
+📧 **Telegram Mail Bridge System**
+
+**Доступные команды:**
+
+📨 **Управление получателями:**
+`/set_target me` - Отправлять себе (Saved Messages)
+`/set_target channel <ID>` - Указать канал
+`/set_target group <ID>` - Указать группу
+`/set_target custom <domain>=<ID>` - Настройка домена
+
+📂 **Работа с письмами:**
+`/view <message_id>` - Просмотр письма
+`/source <message_id>` - Исходный код письма
+`/search [domain]` - Поиск писем по домену
+`/list [limit]` - Список последних писем
+
+🌐 **Управление DNS:**
+`/dns_setup <telegram_username>` - Настройка DNS для t.me
+`/dns_check <domain>` - Проверка DNS конфигурации
+`/dns_records [type]` - Просмотр DNS записей
+
+⚙️ **Система:**
+`/status` - Статус системы
+`/config` - Текущая конфигурация
+"""
+
+_HELP_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("📚 Документация", url="https://core.telegram.org/"),
+    InlineKeyboardButton("🛠 Настройки", callback_data="settings")
+]])
+
+_SET_TARGET_USAGE = (
+    "❌ Укажите тип получателя:\n"
+    "`/set_target me` - себе\n"
+    "`/set_target channel <ID>` - канал\n"
+    "`/set_target group <ID>` - группа\n"
+    "`/set_target custom <domain>=<ID>` - домен"
+)
+
+# Аргумент /set_target custom: непустые домен и ID через '='
+_CUSTOM_TARGET_RE = re.compile(r'([^=\s]+)=(\S+)')
+
+# Шаблоны /view: заголовок и опциональные блоки (начинаются с перевода строки)
+_VIEW_HEADER = (
+    "📄 **Письмо:** `{msg_id}`\n"
+    "\n"
+    "**От:** {sender}\n"
+    "**Кому:** {to}\n"
+    "**Тема:** {subject}\n"
+    "**Дата:** {date}\n"
+    "**Получено:** {received_at}\n"
+)
+_VIEW_BODY = "\n**Текст письма:**\n```\n{body}{ellipsis}\n```"
+_VIEW_ATTACHMENTS = "\n\n**Вложения:** {count}"
+_VIEW_ATTACHMENT = "\n• {content_type} ({size} bytes)"
+
+# Шаблон /status: количество писем, затем значения _status_getters по порядку
+_STATUS_TEMPLATE = (
+    "🟢 **Система работает**\n"
+    "\n"
+    "**Хранилище:** %d писем\n"
+    "**Активный получатель:** %s\n"
+    "**Настроено доменов:** %d\n"
+    "\n"
+    "**SMTP сервер:**\n"
+    "• Порт: %s\n"
+    "• Обработано: %d\n"
+    "\n"
+    "**Компоненты:**\n"
+    "• Redis: %s\n"
+    "• Telegram: %s\n"
+    "• DNS валидатор: %s\n"
+    "• Cloudflare: %s"
+)
+_STATUS_ICONS = {True: '🟢', False: '🔴'}
+
+def _view_keyboard(msg_id: str) -> InlineKeyboardMarkup:
+    """Клавиатура просмотра письма (меняется только callback_data)."""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("📎 Исходник", callback_data=f"source_{msg_id}"),
+        InlineKeyboardButton("🗑 Удалить", callback_data=f"delete_{msg_id}")
+    ]])
 
 class TelegramCommandHandler:
     """Обработчик команд Telegram с выбором получателя и управлением письмами."""
@@ -12,319 +100,300 @@ class TelegramCommandHandler:
                  telegram_client: Client,
                  redis_storage,
                  smtp_handler,
-                 logger):
+                 logger,
+                 sender: Optional[TelegramSender] = None,
+                 chat_cache_ttl: float = 300):
         self.client = telegram_client
         self.redis_storage = redis_storage
         self.smtp_handler = smtp_handler
         self.logger = logger
+        # Cloudflare менеджер SMTP обработчика (None, если не настроен)
+        self.cf_manager = getattr(smtp_handler, 'cf_manager', None)
+        
+        # Все ответы идут через общую очередь с ограничением частоты
+        self.sender = sender or TelegramSender(telegram_client, logger)
+        self.sender.start()
+        
+        # Кэш get_chat: ID чата -> (время получения, чат)
+        self._chat_cache: Dict[int, tuple] = {}
+        self._chat_cache_ttl = chat_cache_ttl
+        
+        # Значения /status в порядке полей _STATUS_TEMPLATE (после количества писем)
+        self._status_getters = (
+            lambda: self.smtp_handler.active_target or 'не указан',
+            lambda: len(self.smtp_handler.target_mapping),
+            lambda: self.smtp_handler.controller.port,
+            lambda: self.smtp_handler.message_counter,
+            lambda: _STATUS_ICONS[bool(self.redis_storage.redis)],
+            lambda: _STATUS_ICONS[bool(self.client.is_connected)],
+            lambda: _STATUS_ICONS[bool(self.smtp_handler.dns_validator)],
+            lambda: _STATUS_ICONS[self.cf_manager is not None]
+        )
         
         # Регистрация обработчиков
         self._register_handlers()
     
+    async def _reply(self, message: Message, text: str, **kwargs):
+        """
+        Ответ в чат сообщения через очередь отправки (ответы команд объединяются).
+        
+        В группах и каналах ответ привязывается к команде, чтобы было видно,
+        кому он адресован.
+        """
+        if message.chat.type != ChatType.PRIVATE:
+            kwargs.setdefault('reply_to_message_id', message.id)
+        return await self.sender.send(message.chat.id, text, coalesce=True, **kwargs)
+    
+    async def _reply_plain(self, message: Message, text: str):
+        """Ответ без разметки: текст не разбирается как Markdown."""
+        return await self._reply(message, text, parse_mode=ParseMode.DISABLED)
+    
+    async def _get_chat_cached(self, chat_id: int):
+        """Получение чата с кэшированием на chat_cache_ttl секунд."""
+        now = time.monotonic()
+        cached = self._chat_cache.get(chat_id)
+        if cached and now - cached[0] < self._chat_cache_ttl:
+            return cached[1]
+        
+        chat = await self.client.get_chat(chat_id)
+        self._chat_cache[chat_id] = (now, chat)
+        return chat
+    
     def _register_handlers(self):
-        """Регистрация всех обработчиков команд."""
+        """Регистрация одного обработчика с диспетчеризацией по команде."""
+        self._dispatch = {
+            "start": self._start_command,
+            "set_target": self._set_target_command,
+            "view": self._view_email_command,
+            "search": self._search_emails_command,
+            "list": self._search_emails_command,
+            "dns_setup": self._dns_setup_command,
+            "status": self._status_command
+        }
         
-        @self.client.on_message(filters.command("start"))
-        async def start_command(client: Client, message: Message):
-            """Обработчик команды /start."""
-            help_text = """
-            📧 **Telegram Mail Bridge System**
-            
-            **Доступные команды:**
-            
-            📨 **Управление получателями:**
-            `/set_target me` - Отправлять себе (Saved Messages)
-            `/set_target channel <ID>` - Указать канал
-            `/set_target group <ID>` - Указать группу
-            `/set_target custom <domain>=<ID>` - Настройка домена
+        @self.client.on_message(filters.command(list(self._dispatch)))
+        async def dispatch_command(client: Client, message: Message):
+            handler = self._dispatch.get(message.command[0].lower())
+            if handler:
+                await handler(client, message)
+    
+    async def _start_command(self, client: Client, message: Message):
+        """Обработчик команды /start."""
+        await self._reply(
+            message,
+            _HELP_TEXT,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=_HELP_KEYBOARD
+        )
+    
+    async def _set_target_command(self, client: Client, message: Message):
+        """Настройка получателя уведомлений."""
+        try:
+            args = message.command[1:]
             
-            📂 **Работа с письмами:**
-            `/view <message_id>` - Просмотр письма
-            `/source <message_id>` - Исходный код письма
-            `/search [domain]` - Поиск писем по домену
-            `/list [limit]` - Список последних писем
+            if not args:
+                await self._reply(message, _SET_TARGET_USAGE)
+                return
             
-            🌐 **Управление DNS:**
-            `/dns_setup <telegram_username>` - Настройка DNS для t.me
-            `/dns_check <domain>` - Проверка DNS конфигурации
-            `/dns_records [type]` - Просмотр DNS записей
+            target_type = args[0].lower()
             
-            ⚙️ **Система:**
-            `/status` - Статус системы
-            `/config` - Текущая конфигурация
-            """
+            if target_type == 'me':
+                self.smtp_handler.set_default_recipient('me')
+                await self._reply_plain(message, "✅ Уведомления будут отправляться вам в Saved Messages")
             
-            await message.reply_text(
-                help_text,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("📚 Документация", url="https://core.telegram.org/"),
-                    InlineKeyboardButton("🛠 Настройки", callback_data="settings")
-                ]])
-            )
-        
-        @self.client.on_message(filters.command("set_target"))
-        async def set_target_command(client: Client, message: Message):
-            """Настройка получателя уведомлений."""
-            try:
-                args = message.text.split()[1:]
-                
-                if not args:
-                    await message.reply_text(
-                        "❌ Укажите тип получателя:\n"
-                        "`/set_target me` - себе\n"
-                        "`/set_target channel <ID>` - канал\n"
-                        "`/set_target group <ID>` - группа\n"
-                        "`/set_target custom <domain>=<ID>` - домен"
-                    )
+            elif target_type in ['channel', 'group']:
+                if len(args) < 2:
+                    await self._reply_plain(message, f"❌ Укажите ID {target_type}")
                     return
                 
-                target_type = args[0].lower()
-                
-                if target_type == 'me':
-                    self.smtp_handler.default_recipients.update({
-                        'me': 'self',
-                        'channel': None,
-                        'group': None
-                    })
-                    await message.reply_text("✅ Уведомления будут отправляться вам в Saved Messages")
-                
-                elif target_type in ['channel', 'group']:
-                    if len(args) < 2:
-                        await message.reply_text(f"❌ Укажите ID {target_type}")
-                        return
+                target_id = args[1]
+                try:
+                    # Проверка доступности чата
+                    chat = await self._get_chat_cached(int(target_id))
                     
-                    target_id = args[1]
-                    try:
-                        # Проверка доступности чата
-                        chat = await client.get_chat(int(target_id))
-                        
-                        self.smtp_handler.default_recipients.update({
-                            'me': None,
-                            target_type: target_id,
-                            'group' if target_type == 'channel' else 'channel': None
-                        })
-                        
-                        await message.reply_text(
-                            f"✅ Уведомления будут отправляться в {target_type}: {chat.title}"
-                        )
-                        
-                    except Exception as e:
-                        await message.reply_text(f"❌ Ошибка: {e}")
-                
-                elif target_type == 'custom':
-                    if len(args) < 2 or '=' not in args[1]:
-                        await message.reply_text("❌ Формат: `/set_target custom domain=ID`")
-                        return
+                    self.smtp_handler.set_default_recipient(target_type, target_id)
                     
-                    domain, chat_id = args[1].split('=', 1)
-                    self.smtp_handler.target_mapping[domain] = chat_id
-                    
-                    await message.reply_text(
-                        f"✅ Письма для `{domain}` будут отправляться в `{chat_id}`"
+                    await self._reply_plain(
+                        message,
+                        f"✅ Уведомления будут отправляться в {target_type}: {chat.title}"
                     )
-                
-                else:
-                    await message.reply_text("❌ Неизвестный тип получателя")
                     
-            except Exception as e:
-                await message.reply_text(f"❌ Ошибка: {e}")
-        
-        @self.client.on_message(filters.command("view"))
-        async def view_email_command(client: Client, message: Message):
-            """Просмотр полного письма из Redis."""
-            try:
-                args = message.text.split()[1:]
-                
-                if not args:
-                    await message.reply_text("❌ Укажите ID письма: `/view msg_...`")
-                    return
-                
-                msg_id = args[0]
-                email_data = await self.redis_storage.retrieve_email(msg_id)
-                
-                if not email_data:
-                    await message.reply_text("❌ Письмо не найдено")
+                except Exception as e:
+                    await self._reply_plain(message, f"❌ Ошибка: {e}")
+            
+            elif target_type == 'custom':
+                match = _CUSTOM_TARGET_RE.fullmatch(args[1]) if len(args) > 1 else None
+                if not match:
+                    await self._reply(message, "❌ Формат: `/set_target custom domain=ID`")
                     return
                 
-                metadata = email_data['metadata']
-                email_msg = email_data['message']
-                
-                # Форматирование детального просмотра
-                response = [
-                    f"📄 **Письмо:** `{msg_id}`",
-                    f"",
-                    f"**От:** {metadata['from']}",
-                    f"**Кому:** {metadata['to']}",
-                    f"**Тема:** {metadata['subject']}",
-                    f"**Дата:** {metadata['date']}",
-                    f"**Получено:** {metadata['received_at']}",
-                    f""
-                ]
-                
-                # Тело письма
-                parsed = email_data.get('parsed', {})
-                if parsed.get('body', {}).get('plain'):
-                    body = parsed['body']['plain']
-                    if isinstance(body, bytes):
-                        body = body.decode('utf-8', errors='ignore')
-                    
-                    response.append("**Текст письма:**")
-                    response.append("```")
-                    response.append(body[:1500] + ("..." if len(body) > 1500 else ""))
-                    response.append("```")
-                
-                # Вложения
-                attachments = parsed.get('attachments', [])
-                if attachments:
-                    response.append(f"")
-                    response.append(f"**Вложения:** {len(attachments)}")
-                    for att in attachments[:5]:
-                        response.append(f"• {att['content_type']} ({att['size']} bytes)")
+                domain, chat_id = match.groups()
+                self.smtp_handler.target_mapping[domain] = chat_id
                 
-                await message.reply_text(
-                    "\n".join(response),
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton(
-                            "📎 Исходник", 
-                            callback_data=f"source_{msg_id}"
-                        ),
-                        InlineKeyboardButton(
-                            "🗑 Удалить", 
-                            callback_data=f"delete_{msg_id}"
-                        )
-                    ]])
+                await self._reply(
+                    message,
+                    f"✅ Письма для `{domain}` будут отправляться в `{chat_id}`"
                 )
+            
+            else:
+                await self._reply_plain(message, "❌ Неизвестный тип получателя")
                 
-            except Exception as e:
-                self.logger.error(f"Ошибка команды /view: {e}")
-                await message.reply_text(f"❌ Ошибка: {e}")
-        
-        @self.client.on_message(filters.command(["search", "list"]))
-        async def search_emails_command(client: Client, message: Message):
-            """Поиск и список писем."""
-            try:
-                args = message.text.split()[1:]
-                command = message.command[0]
-                
-                if command == "search":
-                    domain = args[0] if args else None
-                    emails = await self.redis_storage.search_emails(domain=domain, limit=20)
-                    title = f"Поиск по домену: {domain}" if domain else "Все письма"
-                else:  # list
-                    limit = int(args[0]) if args and args[0].isdigit() else 10
-                    emails = await self.redis_storage.search_emails(limit=limit)
-                    title = f"Последние {limit} писем"
-                
-                if not emails:
-                    await message.reply_text("📭 Писем не найдено")
-                    return
-                
-                response = [f"📂 **{title}**", ""]
-                
-                for i, email_data in enumerate(emails[:15], 1):
-                    metadata = email_data['metadata']
-                    response.append(
-                        f"{i}. `{metadata['message_id']}` - "
-                        f"**{metadata['subject'][:50]}**\n"
-                        f"   📨 {metadata['from'][:30]} → {metadata['to'][:30]}\n"
-                        f"   🕐 {metadata['received_at']}"
-                    )
-                
-                await message.reply_text(
-                    "\n".join(response),
-                    parse_mode=ParseMode.MARKDOWN
+        except Exception as e:
+            await self._reply_plain(message, f"❌ Ошибка: {e}")
+    
+    async def _view_email_command(self, client: Client, message: Message):
+        """Просмотр полного письма из Redis."""
+        try:
+            args = message.command[1:]
+            
+            if not args:
+                await self._reply(message, "❌ Укажите ID письма: `/view msg_...`")
+                return
+            
+            msg_id = args[0]
+            email_data = await self.redis_storage.retrieve_view(msg_id)
+            
+            if not email_data:
+                await self._reply_plain(message, "❌ Письмо не найдено")
+                return
+            
+            metadata = email_data['metadata']
+            
+            # Форматирование детального просмотра
+            response = _VIEW_HEADER.format(
+                msg_id=msg_id,
+                sender=metadata['from'],
+                to=metadata['to'],
+                subject=metadata['subject'],
+                date=metadata['date'],
+                received_at=metadata['received_at']
+            )
+            
+            # Тело письма (превью подготовлено при сохранении)
+            if email_data['body_preview']:
+                response += _VIEW_BODY.format(
+                    body=email_data['body_preview'],
+                    ellipsis="..." if email_data['body_truncated'] else ""
                 )
-                
-            except Exception as e:
-                self.logger.error(f"Ошибка команды /search: {e}")
-                await message.reply_text(f"❌ Ошибка: {e}")
-        
-        @self.client.on_message(filters.command("dns_setup"))
-        async def dns_setup_command(client: Client, message: Message):
-            """Настройка DNS для интеграции t.me."""
-            try:
-                args = message.text.split()[1:]
-                
-                if not args:
-                    await message.reply_text("❌ Укажите Telegram username: `/dns_setup @username`")
-                    return
-                
-                username = args[0].replace('@', '')
-                
-                await message.reply_text(
+            
+            # Вложения (сохранены только первые)
+            if email_data['attachment_count']:
+                response += _VIEW_ATTACHMENTS.format(count=email_data['attachment_count'])
+                response += "".join(
+                    _VIEW_ATTACHMENT.format_map(att) for att in email_data['attachments']
+                )
+            
+            await self._reply(
+                message,
+                response,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=_view_keyboard(msg_id)
+            )
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка команды /view: {e}")
+            await self._reply_plain(message, f"❌ Ошибка: {e}")
+    
+    async def _search_emails_command(self, client: Client, message: Message):
+        """Поиск и список писем."""
+        try:
+            args = message.command[1:]
+            command = message.command[0]
+            
+            if command == "search":
+                domain = args[0] if args else None
+                summaries = await self.redis_storage.search_summaries(
+                    domain=domain, limit=20
+                )
+                title = f"Поиск по домену: {domain}" if domain else "Все письма"
+            else:  # list
+                limit = int(args[0]) if args and args[0].isdigit() else 10
+                summaries = await self.redis_storage.search_summaries(limit=limit)
+                title = f"Последние {limit} писем"
+            
+            if not summaries:
+                await self._reply_plain(message, "📭 Писем не найдено")
+                return
+            
+            # Строки писем подготовлены при сохранении
+            response = [f"📂 **{title}**", ""]
+            response.extend(
+                f"{i}. {summary}" for i, summary in enumerate(summaries[:15], 1)
+            )
+            
+            await self._reply(
+                message,
+                "\n".join(response),
+                parse_mode=ParseMode.MARKDOWN
+            )
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка команды /search: {e}")
+            await self._reply_plain(message, f"❌ Ошибка: {e}")
+    
+    async def _dns_setup_command(self, client: Client, message: Message):
+        """Настройка DNS для интеграции t.me."""
+        try:
+            args = message.command[1:]
+            
+            if not args:
+                await self._reply(message, "❌ Укажите Telegram username: `/dns_setup @username`")
+                return
+            
+            username = args[0].replace('@', '')
+            
+            # Используем Cloudflare менеджер из SMTP обработчика
+            if self.cf_manager is not None:
+                # Подтверждение уходит до начала настройки: ошибка отправки
+                # не оставляет настройку DNS работать без ответа
+                await self._reply(
+                    message,
                     f"🔄 Настраиваю DNS для `{username}`...\n"
                     f"Это может занять до 5 минут."
                 )
+                result = await self.cf_manager.ensure_tmail_integration(username)
                 
-                # Используем Cloudflare менеджер из SMTP обработчика
-                if hasattr(self.smtp_handler, 'cf_manager'):
-                    result = await self.smtp_handler.cf_manager.ensure_tmail_integration(username)
+                if 'error' not in result:
+                    response = [
+                        f"✅ **DNS настройка завершена**",
+                        f"",
+                        f"**Telegram:** @{username}",
+                        f"**Почта:** {result.get('email_address', 'N/A')}",
+                        f"**Поддомен:** {result.get('subdomain', 'N/A')}",
+                        f""
+                    ]
                     
-                    if 'error' not in result:
-                        response = [
-                            f"✅ **DNS настройка завершена**",
-                            f"",
-                            f"**Telegram:** @{username}",
-                            f"**Почта:** {result.get('email_address', 'N/A')}",
-                            f"**Поддомен:** {result.get('subdomain', 'N/A')}",
-                            f""
-                        ]
-                        
-                        if result.get('mx_records'):
-                            response.append("**MX записи:**")
-                            for mx in result['mx_records']:
-                                status = "✅" if mx['success'] else "❌"
-                                response.append(f"{status} {mx['server']} (приоритет {mx['priority']})")
-                        
-                        await message.reply_text("\n".join(response))
-                    else:
-                        await message.reply_text(f"❌ Ошибка: {result['error']}")
-                else:
-                    await message.reply_text("❌ Cloudflare менеджер не настроен")
+                    if result.get('mx_records'):
+                        response.append("**MX записи:**")
+                        for mx in result['mx_records']:
+                            status = "✅" if mx['success'] else "❌"
+                            response.append(f"{status} {mx['server']} (приоритет {mx['priority']})")
                     
-            except Exception as e:
-                self.logger.error(f"Ошибка команды /dns_setup: {e}")
-                await message.reply_text(f"❌ Ошибка: {e}")
-        
-        @self.client.on_message(filters.command("status"))
-        async def status_command(client: Client, message: Message):
-            """Получение статуса системы."""
-            try:
-                # Статистика Redis
-                email_count = len(await self.redis_storage.search_emails(limit=1000))
-                
-                # Настройки получателей
-                targets = self.smtp_handler.default_recipients
-                active_target = None
-                for key, value in targets.items():
-                    if value:
-                        active_target = f"{key}: {value}"
-                        break
-                
-                status_text = [
-                    "🟢 **Система работает**",
-                    "",
-                    f"**Хранилище:** {email_count} писем",
-                    f"**Активный получатель:** {active_target or 'не указан'}",
-                    f"**Настроено доменов:** {len(self.smtp_handler.target_mapping)}",
-                    "",
-                    "**SMTP сервер:**",
-                    f"• Порт: {self.smtp_handler.controller.port}",
-                    f"• Обработано: {self.smtp_handler.message_counter}",
-                    "",
-                    "**Компоненты:**",
-                    f"• Redis: {'🟢' if self.redis_storage.redis else '🔴'}",
-                    f"• Telegram: {'🟢' if client.is_connected else '🔴'}",
-                    f"• DNS валидатор: {'🟢' if self.smtp_handler.dns_validator else '🔴'}",
-                    f"• Cloudflare: {'🟢' if hasattr(self.smtp_handler, 'cf_manager') else '🔴'}"
-                ]
-                
-                await message.reply_text(
-                    "\n".join(status_text),
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                    await self._reply(message, "\n".join(response))
+                else:
+                    await self._reply_plain(message, f"❌ Ошибка: {result['error']}")
+            else:
+                await self._reply_plain(message, "❌ Cloudflare менеджер не настроен")
                 
-            except Exception as e:
-                await message.reply_text(f"❌ Ошибка статуса: {e}")
\ No newline at end of file
+        except Exception as e:
+            self.logger.error(f"Ошибка команды /dns_setup: {e}")
+            await self._reply_plain(message, f"❌ Ошибка: {e}")
+    
+    async def _status_command(self, client: Client, message: Message):
+        """Получение статуса системы."""
+        try:
+            # Статистика Redis
+            email_count = await self.redis_storage.count_emails()
+            
+            status_text = _STATUS_TEMPLATE % (
+                email_count, *(getter() for getter in self._status_getters)
+            )
+            
+            await self._reply(
+                message,
+                status_text,
+                parse_mode=ParseMode.MARKDOWN
+            )
+            
+        except Exception as e:
+            await self._reply_plain(message, f"❌ Ошибка статуса: {e}")
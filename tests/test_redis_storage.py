@@ -0,0 +1,170 @@
+"""
+Тесты RedisStorage без сервера Redis: пакетная запись и превью писем.
+"""
+import asyncio
+import logging
+from email import message_from_bytes
+from email.policy import default
+
+from core.redis_storage import RedisStorage
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _FakePipeline:
+    """Pipeline, собирающий вызовы скрипта до execute."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.queued = []
+
+    async def execute(self, raise_on_error=True):
+        self.redis.executed.append(len(self.queued))
+        if self.redis.fail_next_execute:
+            self.redis.fail_next_execute = False
+            raise ConnectionError("connection reset")
+        return [self.redis.apply(keys, args) for keys, args in self.queued]
+
+
+class _FakeScript:
+    """Скрипт сохранения: пишет в словарь или ставится в pipeline."""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def __call__(self, keys=None, args=None, client=None):
+        if isinstance(client, _FakePipeline):
+            client.queued.append((keys, args))
+            return client
+        result = self.redis.apply(keys, args)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class _FakeRedis:
+    """Минимальный клиент Redis для _flush_writes."""
+
+    def __init__(self):
+        self.stored = {}
+        self.executed = []
+        self.failing_ids = set()
+        self.fail_next_execute = False
+
+    def apply(self, keys, args):
+        email_id = args[3]
+        if email_id in self.failing_ids:
+            return RuntimeError("OOM command not allowed")
+        self.stored[email_id] = args[0]
+        return 1
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+
+def _make_storage():
+    storage = RedisStorage({'host': 'localhost', 'port': 6379}, _LOGGER)
+    storage.redis = _FakeRedis()
+    storage._store_script = _FakeScript(storage.redis)
+    return storage
+
+
+async def _store_many(storage, email_ids):
+    metadata = {'recipient_domain': 'example.com', 'subject': 'Тест'}
+    view = {'body_preview': '', 'attachments': [], 'attachment_count': 0}
+    return await asyncio.wait_for(asyncio.gather(*(
+        storage.store_email(email_id, b'Subject: test\r\n\r\nbody', metadata, view)
+        for email_id in email_ids
+    )), timeout=1)
+
+
+def test_concurrent_writes_share_one_pipeline():
+    storage = _make_storage()
+    email_ids = [f"msg_{i}" for i in range(5)]
+
+    results = asyncio.run(_store_many(storage, email_ids))
+
+    assert results == [True] * 5
+    assert storage.redis.executed == [5]
+    assert set(storage.redis.stored) == set(email_ids)
+
+
+def test_failed_item_does_not_drop_the_rest_of_the_batch():
+    storage = _make_storage()
+    storage.redis.failing_ids.add('msg_2')
+    email_ids = [f"msg_{i}" for i in range(5)]
+
+    results = asyncio.run(_store_many(storage, email_ids))
+
+    assert results == [True, True, False, True, True]
+    assert set(storage.redis.stored) == set(email_ids) - {'msg_2'}
+
+
+def test_failed_flush_resolves_every_writer_and_next_flush_succeeds():
+    storage = _make_storage()
+    storage.redis.fail_next_execute = True
+
+    async def scenario():
+        failed = await _store_many(storage, ['msg_0', 'msg_1', 'msg_2'])
+        stored = await _store_many(storage, ['msg_3', 'msg_4'])
+        return failed, stored
+
+    failed, stored = asyncio.run(scenario())
+
+    # Ни один вызов не завис, ошибка pipeline не теряет следующий пакет
+    assert failed == [False, False, False]
+    assert stored == [True, True]
+    assert storage.redis.executed == [3, 2]
+    assert set(storage.redis.stored) == {'msg_3', 'msg_4'}
+    assert not storage._pending_writes
+    assert storage._flush_task is None
+
+
+_FORWARDED_EMAIL = b"""\
+From: sender@example.com
+To: user@example.com
+Subject: Fwd: report
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="outer"
+
+--outer
+Content-Type: text/plain; charset="utf-8"
+
+See the forwarded message.
+--outer
+Content-Type: message/rfc822
+Content-Disposition: attachment; filename="report.eml"
+
+From: boss@example.com
+Subject: report
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="inner"
+
+--inner
+Content-Type: text/plain; charset="utf-8"
+
+Inner body.
+--inner
+Content-Type: application/pdf
+Content-Disposition: attachment; filename="report.pdf"
+Content-Transfer-Encoding: base64
+
+JVBERi0xLjQK
+--inner--
+--outer--
+"""
+
+
+def test_forwarded_message_is_a_single_attachment():
+    storage = _make_storage()
+    email_msg = message_from_bytes(_FORWARDED_EMAIL, policy=default)
+
+    view = storage.build_view(email_msg)
+    structure = storage._parse_email_structure(email_msg)
+
+    assert view['body_preview'] == "See the forwarded message."
+    assert view['attachment_count'] == 1
+    assert view['attachments'][0]['content_type'] == "message/rfc822"
+    assert view['attachments'][0]['size'] > 0
+    assert structure['body']['plain'] == b"See the forwarded message."
+    assert [att['content_type'] for att in structure['attachments']] == ["message/rfc822"]